@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+#############################################################################################
+# File : batch_segment.py
+# Function : Runs the segmentation of segment.py over many images across a process pool.
+#            Inputs are image files, directories or glob patterns, and every image is written
+#            to the output directory under its own name. Images whose output is newer than
+#            the input are skipped, and a JSON manifest records the result of every image.
+#            With --stats the time and memory of every stage is written to a JSON report
+#            next to each output, and summarized over the batch in the manifest.
+#
+# Usage : python3 batch_segment.py survey/*.jpg more_frames/ -o segmented --workers 8
+#############################################################################################
+
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+from segment import Segment
+from stage_cache import StageCache
+from stage_stats import summarize
+
+# file extensions picked up from input directories
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp')
+
+
+#############################################################################################
+# Name : collect_images
+# Function : expands a list of image files, directories and glob patterns into a sorted list
+#            of image files without duplicates
+#############################################################################################
+
+def collect_images(inputs):
+
+    images = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for name in os.listdir(pattern):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    images.add(os.path.join(pattern, name))
+        elif os.path.isfile(pattern):
+            images.add(pattern)
+        else:
+            images.update(path for path in glob.glob(pattern, recursive=True)
+                          if os.path.isfile(path))
+    return sorted(images)
+
+
+#############################################################################################
+# Name : plan_jobs
+# Function : returns a list of (image, output path) pairs. Outputs keep the image file name,
+#            so images from different directories must not share a name
+#############################################################################################
+
+def plan_jobs(images, output_dir):
+
+    jobs = []
+    outputs = {}
+    for image in images:
+        output = os.path.join(output_dir, os.path.basename(image))
+        if output in outputs:
+            raise ValueError("%s and %s would both be written to %s" % (outputs[output], image, output))
+        outputs[output] = image
+        jobs.append((image, output))
+    return jobs
+
+
+#############################################################################################
+# Name : is_up_to_date
+# Function : checks whether an output exists and is newer than its image
+#############################################################################################
+
+def is_up_to_date(image, output):
+    return os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(image)
+
+
+#############################################################################################
+# Name : stats_path
+# Function : returns the stage report file of an output
+#############################################################################################
+
+def stats_path(output):
+    return os.path.splitext(output)[0] + '.stats.json'
+
+
+#############################################################################################
+# Name : init_worker
+# Function : keeps OpenCV to one thread per worker process so the pool does not oversubscribe
+#            the cores
+#############################################################################################
+
+def init_worker():
+    cv2.setNumThreads(1)
+
+
+#############################################################################################
+# Name : run_job
+# Function : segments one image, reusing the stage outputs of cache_dir if given, and returns
+#            its manifest entry. With stats the stage report is written next to the output and
+#            returned in the entry. low_memory runs the low memory pipeline of Segment
+#############################################################################################
+
+def run_job(job, cache_dir=None, cache_bytes=None, stats=False, low_memory=False):
+
+    image, output = job
+    start = time.perf_counter()
+    entry = {'image': image, 'output': output}
+    try:
+        cache = StageCache(cache_dir, cache_bytes) if cache_dir else None
+        segment = Segment(image, verbose=False, cache=cache)
+        if stats:
+            segment.enable_stats()
+        segment.execute(output, low_memory)
+        if stats:
+            segment.stats.write(stats_path(output))
+            entry['stats'] = segment.stats.report()
+        entry['status'] = 'done'
+    except Exception as error:
+        entry['status'] = 'failed'
+        entry['error'] = '%s: %s' % (type(error).__name__, error)
+    entry['seconds'] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+#############################################################################################
+# Name : run_batch
+# Function : segments every job that is not up to date (all of them with force) across
+#            workers processes and returns the manifest entries in job order. The workers share
+#            the stage cache in cache_dir. stats and low_memory are passed on to run_job
+#############################################################################################
+
+def run_batch(jobs, workers=None, force=False, cache_dir=None, cache_bytes=2 * 2 ** 30, stats=False,
+              low_memory=False):
+
+    entries = {}
+    pending = []
+    for job in jobs:
+        if not force and is_up_to_date(*job):
+            entries[job] = {'image': job[0], 'output': job[1], 'status': 'skipped', 'seconds': 0.0}
+        else:
+            pending.append(job)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            results = executor.map(run_job, pending, [cache_dir] * len(pending),
+                                   [cache_bytes] * len(pending), [stats] * len(pending),
+                                   [low_memory] * len(pending))
+            for job, entry in zip(pending, results):
+                entries[job] = entry
+                print("[%s] %s (%.1f s)" % (entry['status'], job[0], entry['seconds']))
+
+    return [entries[job] for job in jobs]
+
+
+#############################################################################################
+# Name : write_manifest
+# Function : writes the manifest entries and their status counts to a JSON file. The stage
+#            reports of the entries are replaced by their files and summarized over the batch
+#############################################################################################
+
+def write_manifest(entries, filename, wall_time):
+
+    counts = {}
+    reports = []
+    images = []
+    for entry in entries:
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        entry = dict(entry)
+        if 'stats' in entry:
+            reports.append(entry['stats'])
+            entry['stats'] = stats_path(entry['output'])
+        images.append(entry)
+
+    manifest = {'counts': counts, 'wall_time_s': round(wall_time, 3), 'images': images}
+    if reports:
+        manifest['stage_summary'] = summarize(reports)
+    with open(filename, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return counts
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Segment many images in parallel')
+    parser.add_argument('inputs', nargs='+', help='image files, directories or glob patterns')
+    parser.add_argument('-o', '--output-dir', default='segmented', help='output directory')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: all cores)')
+    parser.add_argument('--force', action='store_true', help='also segment images whose output is up to date')
+    parser.add_argument('--manifest', help='manifest file (default: OUTPUT_DIR/manifest.json)')
+    parser.add_argument('--cache', help='directory of the stage output cache')
+    parser.add_argument('--cache-size', type=float, default=2048, help='cache size bound in MiB')
+    parser.add_argument('--stats', action='store_true',
+                        help='write a stage time and memory report per image and summarize them')
+    parser.add_argument('--low-memory', action='store_true',
+                        help='reuse a few scratch buffers per image so that more workers fit in memory')
+    args = parser.parse_args()
+
+    if args.low_memory and args.cache:
+        parser.error("--low-memory does not use the stage cache")
+
+    images = collect_images(args.inputs)
+    if not images:
+        parser.error("no images found")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = plan_jobs(images, args.output_dir)
+
+    start = time.perf_counter()
+    entries = run_batch(jobs, args.workers, args.force, args.cache, int(args.cache_size * 2 ** 20),
+                        args.stats, args.low_memory)
+    manifest = args.manifest or os.path.join(args.output_dir, 'manifest.json')
+    counts = write_manifest(entries, manifest, time.perf_counter() - start)
+
+    print(", ".join("%d %s" % (count, status) for status, count in sorted(counts.items())))
+    print("Manifest written to " + manifest)
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+#############################################################################################
+# File : benchmark_segment.py
+# Function : Benchmarks every Segment method and the full pipeline on synthetic crop row
+#            images of increasing resolution, and checks the output of every stage against the
+#            golden hashes in golden_hashes.json. A faster implementation of a stage has to
+#            leave its hash unchanged. On the fields where thinning reaches furthest,
+#            execute_tiled has to match create_final_image. Every case records ops/sec,
+#            p50/p99 latency per call and peak traced memory. Results can be saved as a
+#            baseline JSON and later runs compared against it. Exits with status 1 on a failed
+#            check or a regression.
+#
+# Usage : python3 benchmark_segment.py --save-baseline baseline.json
+#         python3 benchmark_segment.py --compare baseline.json
+#         python3 benchmark_segment.py --golden-only
+#############################################################################################
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from segment import Segment
+from stage_cache import hash_array
+from synthetic_field import MIXED, ORIENTATIONS, make_field
+
+# a case is a regression when its p50 latency grows by more than this factor
+REGRESSION_FACTOR = 1.2
+
+# (height, width) of the benchmark images, the last is 12 MP
+RESOLUTIONS = [(600, 800), (1500, 2000), (3000, 4000)]
+
+# worker threads of the threaded cases
+THREADS = 4
+
+# (height, width) of the golden images, generated in every orientation and mixed
+GOLDEN_RESOLUTIONS = [(600, 800), (1200, 1600)]
+
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden_hashes.json')
+
+# make_field options of the fields whose thinning reaches furthest from a window edge: long
+# diagonal plants, which Zhang-Suen erodes from their ends, and the mixed field
+TILED_FIELDS = [('diagonal', {'plant_length': 400, 'row_width': 24}), (MIXED, {})]
+
+# (height, width) of the fields of the thinning reach check, and of the tiled check with its
+# tile size, which leaves window edges inside the image with the default halo of 600
+REACH_RESOLUTION = (600, 800)
+TILED_RESOLUTION = (1500, 1500)
+TILED_TILE_SIZE = 900
+
+# stage outputs of create_final_image, in pipeline order
+STAGES = ['binary_image', 'thin_image', 'vertical_edges', 'filtered_vertical_edges',
+          'horizontal_edges', 'filtered_horizontal_edges', 'vertical_edges_mask',
+          'horizontal_edges_mask', 'diagonal_edges', 'filtered_diagonal_edges',
+          'diagonal_edges_mask', 'final_image']
+
+
+#############################################################################################
+# Name : measure
+# Function : calls fn(i) for i in range(calls) and returns ops/sec, p50 and p99 latency in ms
+#            and the peak traced memory in KiB (measured in one more call, since tracing slows
+#            the calls down)
+#############################################################################################
+
+def measure(fn, calls):
+
+    latencies = np.empty(calls)
+    total_start = time.perf_counter()
+    for i in range(calls):
+        start = time.perf_counter()
+        fn(i)
+        latencies[i] = time.perf_counter() - start
+    total = time.perf_counter() - total_start
+
+    tracemalloc.start()
+    fn(calls)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'calls': calls,
+            'ops_per_sec': calls / total,
+            'p50_ms': 1000 * float(np.percentile(latencies, 50)),
+            'p99_ms': 1000 * float(np.percentile(latencies, 99)),
+            'peak_kib': peak / 1024}
+
+
+#############################################################################################
+# Name : stage_hashes
+# Function : runs the pipeline on an image and returns the hash of every stage output, with
+#            the final images of the low memory and the threaded pipeline as
+#            'final_image_low_memory' and 'final_image_threaded'
+#############################################################################################
+
+def stage_hashes(image):
+
+    segment = Segment('synthetic', verbose=False, image=image)
+    segment.create_final_image()
+    hashes = {stage: hash_array(getattr(segment, stage)) for stage in STAGES}
+
+    low_memory = Segment('synthetic', verbose=False, image=image).create_final_image_low_memory()
+    hashes['final_image_low_memory'] = hash_array(low_memory)
+
+    threaded = Segment('synthetic', verbose=False, image=image, workers=THREADS).create_final_image()
+    hashes['final_image_threaded'] = hash_array(threaded)
+    return hashes
+
+
+#############################################################################################
+# Name : golden_cases
+# Function : returns the golden hashes of every orientation and the mixed field at every
+#            golden resolution
+#############################################################################################
+
+def golden_cases():
+
+    cases = {}
+    for height, width in GOLDEN_RESOLUTIONS:
+        for orientation in sorted(ORIENTATIONS) + [MIXED]:
+            cases['%s/%dx%d' % (orientation, height, width)] = stage_hashes(
+                make_field(height, width, orientation))
+    return cases
+
+
+#############################################################################################
+# Name : check_golden
+# Function : prints the stages whose output differs from the golden hashes and returns their
+#            names. The low memory and threaded final images have to match the golden final image
+#############################################################################################
+
+def check_golden(cases, golden):
+
+    mismatches = []
+    for case, hashes in cases.items():
+        if case not in golden:
+            print('%-30s no golden hashes' % case)
+            continue
+        for stage, digest in hashes.items():
+            expected = golden[case]['final_image' if stage.startswith('final_image') else stage]
+            if digest != expected:
+                mismatches.append('%s/%s' % (case, stage))
+                print('%-30s %-28s MISMATCH' % (case, stage))
+    print('%d golden case(s) checked, %d mismatch(es)' % (len(cases), len(mismatches)))
+    return mismatches
+
+
+#############################################################################################
+# Name : thinning_reach
+# Function : thins windows of the binary image of a segment cut at random offsets and returns
+#            the largest distance from a cut edge at which the thin window differs from the
+#            thin image
+#############################################################################################
+
+def thinning_reach(segment, windows=20, seed=0):
+
+    rng = np.random.default_rng(seed)
+    binary_image = np.ascontiguousarray(segment.create_binary_image(segment.original_image)[:, :, 0])
+    thin_image = segment.thinning_image(binary_image)
+    height, width = binary_image.shape[:2]
+
+    reach = 0
+    for _ in range(windows):
+        y0, x0 = rng.integers(0, height // 2), rng.integers(0, width // 2)
+        y1, x1 = rng.integers(y0 + height // 4, height + 1), rng.integers(x0 + width // 4, width + 1)
+        window = segment.thinning_image(np.ascontiguousarray(binary_image[y0:y1, x0:x1]))
+        rows, cols = np.nonzero(window != thin_image[y0:y1, x0:x1])
+
+        # distance to the nearest cut edge, the image edges are the same in both
+        distance = np.full(len(rows), max(height, width))
+        for cut, edge_distance in ((y0 > 0, rows), (x0 > 0, cols),
+                                   (y1 < height, y1 - y0 - 1 - rows), (x1 < width, x1 - x0 - 1 - cols)):
+            if cut:
+                distance = np.minimum(distance, edge_distance)
+        if len(distance):
+            reach = max(reach, int(distance.max()))
+    return reach
+
+
+#############################################################################################
+# Name : check_tiled
+# Function : checks on the TILED_FIELDS that the thinning of a window changes no pixel further
+#            than Segment.thinning_reach from its edge, and that execute_tiled with the
+#            minimum halo gives the same image as create_final_image. Returns the failed cases
+#############################################################################################
+
+def check_tiled(directory):
+
+    failures = []
+    for orientation, options in TILED_FIELDS:
+        case = orientation + ''.join('/%s=%d' % item for item in sorted(options.items()))
+
+        reach = thinning_reach(Segment('synthetic', verbose=False,
+                                       image=make_field(*REACH_RESOLUTION, orientation, **options)))
+        if reach > Segment.thinning_reach:
+            failures.append(case + '/thinning_reach')
+        print('%-40s thinning reach %3d px (bound %d)' % (case, reach, Segment.thinning_reach))
+
+        image = make_field(*TILED_RESOLUTION, orientation, **options)
+        segment = Segment('synthetic', verbose=False, image=image)
+        final_image = segment.create_final_image()
+        tiled_image = segment.execute_tiled(os.path.join(directory, 'tiled.npy'), TILED_TILE_SIZE,
+                                            segment.minimum_halo())
+        if not np.array_equal(tiled_image, final_image):
+            failures.append(case + '/execute_tiled')
+            print('%-40s execute_tiled MISMATCH' % case)
+    print('%d tiled case(s) checked, %d failure(s)' % (len(TILED_FIELDS), len(failures)))
+    return failures
+
+
+#############################################################################################
+# Name : bench_resolution
+# Function : times every Segment method and the full pipeline on a mixed field of the given
+#            size, whose vertical, horizontal and diagonal rows produce all three masks. The
+#            inputs of every method are the outputs of one run of the pipeline
+#############################################################################################
+
+def bench_resolution(results, height, width, calls, case_filter, directory):
+
+    segment = Segment('synthetic', verbose=False, image=make_field(height, width, MIXED))
+    segment.create_final_image()
+    image = segment.original_image
+    masks = [segment.diagonal_edges_mask, segment.vertical_edges_mask, segment.horizontal_edges_mask]
+    output_path = os.path.join(directory, 'final_image.png')
+
+    cases = [
+        ('create_binary_image', lambda i: segment.create_binary_image(image)),
+        ('thinning_image', lambda i: segment.thinning_image(segment.binary_image)),
+        ('extract_edges/vertical', lambda i: segment.extract_edges(segment.thin_image, 'vertical')),
+        ('extract_edges/horizontal', lambda i: segment.extract_edges(segment.thin_image, 'horizontal')),
+        ('remove_noise', lambda i: segment.remove_noise(segment.vertical_edges)),
+        ('thicken_image', lambda i: segment.thicken_image(segment.filtered_vertical_edges)),
+        ('subtract_image', lambda i: segment.subtract_image(segment.thin_image, masks[1:])),
+        ('apply_mask', lambda i: segment.apply_mask(image, masks, segment.binary_image[:, :, 0] != 0)),
+        ('create_final_image',
+         lambda i: Segment('synthetic', verbose=False, image=image).create_final_image()),
+        ('create_final_image/threads=%d' % THREADS,
+         lambda i: Segment('synthetic', verbose=False, image=image, workers=THREADS).create_final_image()),
+        ('create_preview/scale=0.25',
+         lambda i: Segment('synthetic', verbose=False, image=image).create_preview(0.25)),
+        ('create_final_image_low_memory',
+         lambda i: Segment('synthetic', verbose=False, image=image).create_final_image_low_memory()),
+        ('execute', lambda i: Segment('synthetic', verbose=False, image=image).execute(output_path)),
+    ]
+
+    for name, fn in cases:
+        name = 'segment/%s/%dx%d' % (name, height, width)
+        if case_filter in name:
+            results[name] = measure(fn, calls)
+
+
+#############################################################################################
+# Name : compare
+# Function : prints the change of every case against a baseline and returns the names of the
+#            cases whose p50 latency regressed
+#############################################################################################
+
+def compare(results, baseline):
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['p50_ms'] / max(baseline[name]['p50_ms'], 1e-9)
+        flag = ''
+        if ratio > REGRESSION_FACTOR:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-55s p50 %10.3f ms -> %10.3f ms (x%.2f)%s'
+              % (name, baseline[name]['p50_ms'], result['p50_ms'], ratio, flag))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark the segmentation pipeline')
+    parser.add_argument('--quick', action='store_true', help='skip the 12 MP resolution and run fewer calls')
+    parser.add_argument('--filter', default='', help='only run cases containing this string')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--save-baseline', help='write the results as a baseline JSON file')
+    parser.add_argument('--compare', help='compare against a baseline JSON file')
+    parser.add_argument('--golden', default=GOLDEN_FILE, help='golden hashes JSON file')
+    parser.add_argument('--update-golden', action='store_true',
+                        help='write the current stage hashes as the golden ones')
+    parser.add_argument('--golden-only', action='store_true',
+                        help='only check the golden hashes and the tiled execution')
+    args = parser.parse_args()
+
+    cases = golden_cases()
+    if args.update_golden:
+        with open(args.golden, 'w') as f:
+            json.dump({case: {stage: hashes[stage] for stage in STAGES} for case, hashes in cases.items()},
+                      f, indent=2, sort_keys=True)
+        print('Golden hashes of %d case(s) written to %s' % (len(cases), args.golden))
+        sys.exit(0)
+
+    with open(args.golden) as f:
+        mismatches = check_golden(cases, json.load(f))
+    with tempfile.TemporaryDirectory() as directory:
+        mismatches += check_tiled(directory)
+
+    regressions = []
+    if not args.golden_only:
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for height, width in (RESOLUTIONS[:-1] if args.quick else RESOLUTIONS):
+                bench_resolution(results, height, width, 3 if args.quick else 5, args.filter, directory)
+
+        for name, result in results.items():
+            print('%-55s %9.2f ops/s  p50 %10.3f ms  p99 %10.3f ms  peak %10.1f KiB'
+                  % (name, result['ops_per_sec'], result['p50_ms'], result['p99_ms'], result['peak_kib']))
+
+        for filename in (args.output, args.save_baseline):
+            if filename:
+                with open(filename, 'w') as f:
+                    json.dump(results, f, indent=2)
+
+        if args.compare:
+            with open(args.compare) as f:
+                regressions = compare(results, json.load(f))
+            if regressions:
+                print('%d case(s) regressed by more than %d%%'
+                      % (len(regressions), round(100 * (REGRESSION_FACTOR - 1))))
+
+    if mismatches or regressions:
+        sys.exit(1)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+#############################################################################################
+# File : occupancy_map.py
+# Function : Turns the crop row masks of segment.py into a downsampled occupancy raster for
+#            the RRT planner of the path_planning folder. The raster is written as a .npy file
+#            with a .json sidecar in the format read by OccupancyGrid.from_npy, so a planner
+#            memory maps it with RRT.load_env(..., occupancy_map='field_map.npy'). The
+#            sidecar also records the source image and the downsampling factor, and the
+#            raster is only rebuilt when either changed, so one segmentation run can feed
+#            many planning runs.
+#
+# Usage : python3 occupancy_map.py field.jpg field_map.npy --factor 10
+#############################################################################################
+
+import argparse
+import json
+import os
+
+import cv2
+import numpy as np
+from segment import Segment
+
+
+#############################################################################################
+# Name : downsample_mask
+# Function : reduces a 2D uint8 mask by factor in both directions. A cell is set if any pixel
+#            of its factor x factor block is set, and the blocks at the right and bottom edges
+#            may be partial
+#############################################################################################
+
+def downsample_mask(mask, factor):
+
+    if factor == 1:
+        return mask != 0
+
+    rows = np.arange(0, mask.shape[0], factor)
+    cols = np.arange(0, mask.shape[1], factor)
+    reduced = np.maximum.reduceat(mask, rows, axis=0)
+    reduced = np.maximum.reduceat(reduced, cols, axis=1)
+    return reduced != 0
+
+
+#############################################################################################
+# Name : masks_to_occupancy
+# Function : returns the bool occupancy grid of the crop pixels which lie inside any of the
+#            masks, downsampled by factor. Image rows run downwards while grid rows run along
+#            +y, so the grid is the image flipped upside down
+#############################################################################################
+
+def masks_to_occupancy(binary_image, masks, factor=10):
+
+    crop_rows = masks[0].copy()
+    for mask in masks[1:]:
+        cv2.bitwise_or(crop_rows, mask, dst=crop_rows)
+    cv2.bitwise_and(crop_rows, binary_image.reshape(crop_rows.shape), dst=crop_rows)
+
+    return downsample_mask(crop_rows, factor)[::-1]
+
+
+#############################################################################################
+# Name : source_info
+# Function : returns what the cached raster of an image depends on
+#############################################################################################
+
+def source_info(image_filename, factor, resolution):
+    stat = os.stat(image_filename)
+    return {'image': os.path.abspath(image_filename), 'image_size': stat.st_size,
+            'image_mtime_ns': stat.st_mtime_ns, 'factor': factor, 'resolution': resolution}
+
+
+#############################################################################################
+# Name : is_up_to_date
+# Function : checks whether a cached raster was built from the same image and settings
+#############################################################################################
+
+def is_up_to_date(map_filename, image_filename, factor, resolution):
+
+    meta_filename = os.path.splitext(map_filename)[0] + '.json'
+    if not (os.path.exists(map_filename) and os.path.exists(meta_filename)):
+        return False
+
+    with open(meta_filename) as f:
+        meta = json.load(f)
+    return meta.get('source') == source_info(image_filename, factor, resolution)
+
+
+#############################################################################################
+# Name : load_occupancy_map
+# Function : memory maps a cached raster and returns it with its sidecar metadata
+#############################################################################################
+
+def load_occupancy_map(map_filename):
+
+    with open(os.path.splitext(map_filename)[0] + '.json') as f:
+        meta = json.load(f)
+    return np.load(map_filename, mmap_mode='r'), meta
+
+
+#############################################################################################
+# Name : save_occupancy_map
+# Function : writes a grid as a uint8 .npy raster with its sidecar. origin and resolution are
+#            the world co-ordinates of grid cell (0, 0) and the size of a cell
+#############################################################################################
+
+def save_occupancy_map(map_filename, grid, source, origin=(0.0, 0.0), resolution=1.0):
+
+    np.save(map_filename, np.ascontiguousarray(grid, dtype=np.uint8))
+    with open(os.path.splitext(map_filename)[0] + '.json', 'w') as f:
+        json.dump({'origin': list(origin), 'resolution': resolution, 'source': source}, f)
+
+
+#############################################################################################
+# Name : build_occupancy_map
+# Function : returns the memory mapped occupancy raster of an image, running the
+#            segmentation and writing map_filename only if the cached raster is out of date.
+#            resolution is the world size of one downsampled cell
+#############################################################################################
+
+def build_occupancy_map(image_filename, map_filename, factor=10, resolution=1.0):
+
+    if not is_up_to_date(map_filename, image_filename, factor, resolution):
+        segment = Segment(image_filename)
+        masks = segment.create_masks()
+        grid = masks_to_occupancy(segment.binary_image, masks, factor)
+        save_occupancy_map(map_filename, grid, source_info(image_filename, factor, resolution),
+                           resolution=resolution)
+
+    return load_occupancy_map(map_filename)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Build a planner occupancy map from an image')
+    parser.add_argument('image', help='field image')
+    parser.add_argument('map', help='output .npy raster (a .json sidecar is written next to it)')
+    parser.add_argument('--factor', type=int, default=10, help='downsampling factor')
+    parser.add_argument('--resolution', type=float, default=1.0,
+                        help='world size of one downsampled cell')
+    args = parser.parse_args()
+
+    grid, meta = build_occupancy_map(args.image, args.map, args.factor, args.resolution)
+    print("Occupancy map of %d x %d cells (%.1f%% occupied) in %s"
+          % (grid.shape[1], grid.shape[0], 100.0 * np.count_nonzero(grid) / grid.size, args.map))
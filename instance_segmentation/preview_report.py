@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+#############################################################################################
+# File : preview_report.py
+# Function : Compares the fast preview of segment.py (Segment.create_preview) with the full
+#            resolution pipeline at several scales. For every image and scale it reports the
+#            speedup and the intersection over union of every mask class against the full
+#            resolution result. A crop pixel is in the class of the last mask that covers it,
+#            as in apply_mask. Without image arguments synthetic fields of every orientation
+#            are used.
+#
+# Usage : python3 preview_report.py field.jpg --scales 0.5 0.25 0.125 --output preview.json
+#############################################################################################
+
+import argparse
+import json
+import time
+
+import cv2
+import numpy as np
+from segment import Segment
+from synthetic_field import ORIENTATIONS, make_field
+
+# mask classes in the order of apply_mask, later ones taking precedence
+CLASSES = ['diagonal', 'vertical', 'horizontal']
+
+
+#############################################################################################
+# Name : class_labels
+# Function : returns a uint8 array with the class of every crop pixel of a segment (1 for
+#            diagonal, 2 for vertical, 3 for horizontal) and 0 elsewhere
+#############################################################################################
+
+def class_labels(segment, crop_pixel_mask):
+
+    labels = np.zeros(crop_pixel_mask.shape, np.uint8)
+    masks = [segment.diagonal_edges_mask, segment.vertical_edges_mask, segment.horizontal_edges_mask]
+    for label, mask in enumerate(masks, 1):
+        labels[crop_pixel_mask & (mask == 255)] = label
+    return labels
+
+
+#############################################################################################
+# Name : compare_labels
+# Function : returns the IoU of every class (None if neither result has it), their mean and
+#            the fraction of crop pixels whose class agrees
+#############################################################################################
+
+def compare_labels(labels, reference, crop_pixel_mask):
+
+    ious = {}
+    for label, name in enumerate(CLASSES, 1):
+        ours, theirs = labels == label, reference == label
+        union = np.count_nonzero(ours | theirs)
+        ious[name] = round(np.count_nonzero(ours & theirs) / union, 4) if union else None
+
+    present = [iou for iou in ious.values() if iou is not None]
+    agreement = np.count_nonzero((labels == reference) & crop_pixel_mask) / max(np.count_nonzero(crop_pixel_mask), 1)
+    return {'iou': ious,
+            'mean_iou': round(float(np.mean(present)), 4) if present else None,
+            'agreement': round(agreement, 4)}
+
+
+#############################################################################################
+# Name : report_image
+# Function : runs the full pipeline and the preview at every scale on an image and returns
+#            the timings and the comparisons
+#############################################################################################
+
+def report_image(name, image, scales, workers=1):
+
+    full = Segment(name, verbose=False, image=image, workers=workers)
+    start = time.perf_counter()
+    full.create_final_image()
+    full_seconds = time.perf_counter() - start
+
+    crop_pixel_mask = full.crop_pixels(image)
+    reference = class_labels(full, crop_pixel_mask)
+
+    previews = []
+    for scale in scales:
+        preview = Segment(name, verbose=False, image=image, workers=workers)
+        start = time.perf_counter()
+        preview.create_preview(scale)
+        seconds = time.perf_counter() - start
+
+        entry = {'scale': scale, 'seconds': round(seconds, 3), 'speedup': round(full_seconds / seconds, 2)}
+        entry.update(compare_labels(class_labels(preview, crop_pixel_mask), reference, crop_pixel_mask))
+        previews.append(entry)
+
+    return {'image': name, 'shape': list(image.shape), 'full_seconds': round(full_seconds, 3),
+            'previews': previews}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Compare the segmentation preview with the full resolution result')
+    parser.add_argument('images', nargs='*', help='images (default: synthetic fields of every orientation)')
+    parser.add_argument('--scales', type=float, nargs='+', default=[0.5, 0.25, 0.125], help='preview scales')
+    parser.add_argument('--size', type=int, nargs=2, default=(1500, 2000), metavar=('HEIGHT', 'WIDTH'),
+                        help='size of the synthetic fields')
+    parser.add_argument('--threads', type=int, default=1, help='threads running independent stages at once')
+    parser.add_argument('--output', help='write the report to this JSON file')
+    args = parser.parse_args()
+
+    if args.images:
+        inputs = [(filename, cv2.imread(filename)) for filename in args.images]
+    else:
+        inputs = [('synthetic/' + orientation, make_field(args.size[0], args.size[1], orientation))
+                  for orientation in sorted(ORIENTATIONS)]
+
+    reports = []
+    for name, image in inputs:
+        if image is None:
+            raise ValueError("could not read image " + name)
+        report = report_image(name, image, args.scales, args.threads)
+        reports.append(report)
+
+        print('%s (%d x %d): full resolution %.3f s' % (name, image.shape[1], image.shape[0], report['full_seconds']))
+        for entry in report['previews']:
+            ious = ' '.join('%s %s' % (label, '-' if iou is None else '%.3f' % iou)
+                            for label, iou in entry['iou'].items())
+            print('  scale %-6g %7.3f s  x%-6.1f mean IoU %s  agreement %.3f  (%s)'
+                  % (entry['scale'], entry['seconds'], entry['speedup'],
+                     '-' if entry['mean_iou'] is None else '%.3f' % entry['mean_iou'], entry['agreement'], ious))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
@@ -7,8 +7,14 @@
 #############################################################################################
 
 
+import argparse
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 import cv2
 import numpy as np
+from stage_cache import StageCache, hash_array
+from stage_stats import StageStats
 
 #############################################################################################
 # Name : Segment
@@ -19,133 +25,210 @@ import numpy as np
 
 class Segment:
 
-    def __init__(self, filename):
-
-        self.original_image = cv2.imread(filename)
+    # tiles of execute_tiled start at multiples of this, the least common multiple of the 3, 20
+    # and 100 pixel blocks of extract_edges and remove_noise, so that every block of a tile is a
+    # block of the whole image
+    tile_alignment = 300
+
+    # how far the thinning of a window can change near its edge. A change can only travel
+    # through white pixels, so it stays in the plants which cross the edge. On wide rows it
+    # stops after about half their width, but diagonal plants are eaten away along their length,
+    # and windows of synthetic diagonal fields with 400 pixel plants differed up to 199 pixels
+    # from their edge. So this is the largest reach measured with a margin of half again, not a
+    # hard bound, and benchmark_segment.py checks it on the worst fields it knows of
+    thinning_reach = 300
+
+    # create_preview warns when the diagonal mask holds more than this share of the mask pixels,
+    # since the preview finds little of the diagonal rows of the full resolution masks
+    preview_diagonal_share = 0.5
+
+    # rows per strip of the methods which write to an out buffer, bounding their temporaries
+    strip_rows = 256
+
+    # progress message of every stage, printed by run_stage
+    stage_messages = {
+        'binary_image': "Creating Binary image...",
+        'thin_image': "Thinning the Binary image...",
+        'vertical_edges': "Extracting vertical edges...",
+        'filtered_vertical_edges': "De-noising vertical edges...",
+        'horizontal_edges': "Extracting horizontal edges...",
+        'filtered_horizontal_edges': "De-noising horizontal edges...",
+        'vertical_edges_mask': "Creating vertical edges mask...",
+        'horizontal_edges_mask': "Creating horizontal edges mask...",
+        'diagonal_edges': "Extracting diagonal edges...",
+        'filtered_diagonal_edges': "De-noising diagonal edges...",
+        'diagonal_edges_mask': "Creating diagonal edges mask...",
+        'final_image': "Applying masks to the original image...",
+        'downscale_image': "Downscaling the image for the preview...",
+        'upscale_masks': "Upscaling the preview masks...",
+        'write_image': "Writing the final image...",
+    }
 
     #############################################################################################
-    # Name : create_binary_image
-    # Function : Creates white-black image from an rgb image with white pixels being applied in
-    #            pixels that satisfy a specific condition
+    # Function : filename is an image read with cv2.imread, or a .npy array of shape
+    #            (height, width, 3) in BGR order which is memory mapped. An array already in
+    #            memory can be passed as image instead. With a StageCache the stage outputs are
+    #            reused from earlier runs. workers is the number of threads which run independent
+    #            stages at the same time
     #############################################################################################
 
-    def create_binary_image(self, image):
+    def __init__(self, filename, verbose=True, image=None, cache=None, workers=1):
 
-        height, width, _ = image.shape
-        binary_image = np.zeros((height, width, 1), dtype=np.uint8)
+        self.filename = filename
+        self.verbose = verbose
+        self.cache = cache
+        self.workers = workers
+        self.stats = None
 
-        for y in range(image.shape[0]):
-            for x in range(image.shape[1]):
-                # Get the RGB values of the pixel
-                b, g, r = image[y, x]
-
-                # Check if pixel values represent a crop row
-                # Conditions are extracted from close examination of image pixels
-
-                if r > 100 and g > 100 and b > 100 and (r >= g) and (g/b < 1.2):
-                    # Make the pixel white
-                    binary_image[y, x] = [255]
+        # cache keys of the stage outputs
+        self.keys = {}
+        if image is not None:
+            self.original_image = image
+        elif filename.endswith('.npy'):
+            self.original_image = np.load(filename, mmap_mode='r')
+        else:
+            self.original_image = cv2.imread(filename)
+        if self.original_image is None:
+            raise ValueError("could not read image " + filename)
 
-                else:
-                    # Make the pixel black
-                    binary_image[y, x] = [0]
+    #############################################################################################
+    # Name : log
+    # Function : prints a progress message unless the segment is quiet
+    #############################################################################################
 
-        return binary_image
+    def log(self, message):
+        if self.verbose:
+            print(message)
 
     #############################################################################################
-    # Name : thinning_image
-    # Function : Thins the white pixels
+    # Name : enable_stats
+    # Function : records the wall time, CPU time and peak memory of every stage from now on and
+    #            returns the StageStats. trace_memory=False skips tracemalloc, which slows down
+    #            the allocations made while a stage runs, and so its time
     #############################################################################################
 
-    def thinning_image(self, image):
+    def enable_stats(self, trace_memory=True):
 
-        # Thinning
-        thin_image = cv2.ximgproc.thinning(image)
-        return thin_image
+        self.stats = StageStats(trace_memory)
+        self.stats.image = self.filename
+        self.stats.shape = list(self.original_image.shape)
+        return self.stats
 
     #############################################################################################
-    # Name : extract_edges
-    # Function : Extracts edges from an image with direction of edge specified as either
-    #            'vertical' or 'horizontal'
+    # Name : crop_pixels
+    # Function : Returns a bool array which is True for the pixels of a bgr image whose colour
+    #            represents a crop row. Conditions are extracted from close examination of
+    #            image pixels. g/b < 1.2 is evaluated as 5*g < 6*b in integers, which gives the
+    #            same result for every 8 bit g and b and cannot divide by zero
     #############################################################################################
-    def extract_edges(self, thin_image, direction):
 
-        # Get image dimensions
-        image_height, image_width = thin_image.shape
+    def crop_pixels(self, image):
 
-        # Define step sizes
-        if direction == "horizontal":
-            step_width = 20
-            step_height = 3
-        else:
-            step_width = 3
-            step_height = 20
+        b = image[:, :, 0].astype(np.int16)
+        g = image[:, :, 1].astype(np.int16)
+        r = image[:, :, 2].astype(np.int16)
 
-        threshold_value = 18
+        return (r > 100) & (g > 100) & (b > 100) & (r >= g) & (5 * g < 6 * b)
 
-        # Create a copy of the thinned image to make changes
-        edges_image = thin_image.copy()
+    #############################################################################################
+    # Name : create_binary_image
+    # Function : Creates white-black image from an rgb image with white pixels being applied in
+    #            pixels that satisfy a specific condition (the white pixels are the crop_pixels
+    #            mask passed to apply_mask). With out, a (height, width) uint8 buffer, the image
+    #            is written to out in strips of rows and out is returned
+    #############################################################################################
 
-        # Iterate over the image with the specified step sizes
-        for y in range(0, image_height, step_height):
-            for x in range(0, image_width, step_width):
-                # Calculate the region of interest for this step
-                roi = thin_image[y:min(
-                    y+step_height, image_height), x:min(x+step_width, image_width)]
+    def create_binary_image(self, image, out=None):
 
-                # Calculate the sum of pixel values in the ROI
-                sum_pixels = np.sum(roi)
+        if out is not None:
+            for row in range(0, image.shape[0], self.strip_rows):
+                np.multiply(self.crop_pixels(image[row:row + self.strip_rows]), np.uint8(255),
+                            out=out[row:row + self.strip_rows])
+            return out
 
-                # If the sum of pixel values is less than the threshold, set all pixels in that step to black
-                if sum_pixels/255 < threshold_value:
-                    edges_image[y:min(y+step_height, image_height),
-                                x:min(x+step_width, image_width)] = 0
+        # Make the crop row pixels white and the rest black
+        binary_image = self.crop_pixels(image).astype(np.uint8) * 255
 
-        return edges_image
+        return binary_image[:, :, np.newaxis]
 
     #############################################################################################
-    # Name : remove_noise
-    # Function : removes small collection of white pixels from an image
+    # Name : thinning_image
+    # Function : Thins the white pixels with the given cv2.ximgproc thinning algorithm
     #############################################################################################
-    def remove_noise(self, image):
 
-        image_height, image_width = image.shape
+    def thinning_image(self, image, thinning_type=cv2.ximgproc.THINNING_ZHANGSUEN):
+
+        # Thinning
+        thin_image = cv2.ximgproc.thinning(image, thinningType=thinning_type)
+        return thin_image
 
-        # step sizes
-        step_width = 100
-        step_height = 100
+    #############################################################################################
+    # Name : block_filter
+    # Function : Splits an image into blocks of block_size (height, width), starting at the top
+    #            left corner with partial blocks at the right and bottom, and sets all pixels of
+    #            the blocks with fewer than threshold white pixels (sum of pixel values / 255) to
+    #            black. The block sums are computed for the whole image at once, or with out
+    #            one row of blocks at a time, writing the result to out (which may be image)
+    #############################################################################################
+    def block_filter(self, image, block_size, threshold, out=None):
 
-        threshold_value = 100
+        image_height, image_width = image.shape
+        step_height, step_width = block_size
+
+        if out is not None:
+            cols = np.arange(0, image_width, step_width)
+            for row in range(0, image_height, step_height):
+                strip = image[row:row + step_height]
+                block_sums = np.add.reduceat(strip.sum(axis=0, dtype=np.int64), cols)
+                keep = (block_sums / 255 >= threshold).repeat(step_width)[:image_width]
+                np.multiply(strip, keep, out=out[row:row + step_height])
+            return out
+
+        # Calculate the sum of pixel values in every block
+        rows = np.arange(0, image_height, step_height)
+        cols = np.arange(0, image_width, step_width)
+        block_sums = np.add.reduceat(image, rows, axis=0, dtype=np.int64)
+        block_sums = np.add.reduceat(block_sums, cols, axis=1)
+
+        # Keep the blocks whose sum of pixel values reaches the threshold
+        keep = block_sums / 255 >= threshold
+        keep = keep.repeat(step_height, axis=0)[:image_height]
+        keep = keep.repeat(step_width, axis=1)[:, :image_width]
+
+        return np.where(keep, image, 0).astype(image.dtype)
 
-        filtered_image = image.copy()
+    #############################################################################################
+    # Name : extract_edges
+    # Function : Extracts edges from an image with direction of edge specified as either
+    #            'vertical' or 'horizontal'. block_size defaults to (3, 20) for horizontal and
+    #            (20, 3) for vertical edges
+    #############################################################################################
+    def extract_edges(self, thin_image, direction, block_size=None, threshold=18, out=None):
 
-        # Iterate over the image with the specified step sizes
-        for y in range(0, image_height, step_height):
-            for x in range(0, image_width, step_width):
-                # Calculate the region of interest for this step
-                roi = image[y:min(y+step_height, image_height),
-                            x:min(x+step_width, image_width)]
+        # Define step sizes
+        if block_size is None:
+            block_size = (3, 20) if direction == "horizontal" else (20, 3)
 
-                # Calculate the sum of pixel values in the ROI
-                sum_pixels = np.sum(roi)
+        return self.block_filter(thin_image, block_size, threshold, out)
 
-                # If the sum of pixel values is less than the threshold, set all pixels in that step to black
-                if sum_pixels/255 < threshold_value:
-                    filtered_image[y:min(
-                        y+step_height, image_height), x:min(x+step_width, image_width)] = 0
+    #############################################################################################
+    # Name : remove_noise
+    # Function : removes small collection of white pixels from an image
+    #############################################################################################
+    def remove_noise(self, image, block_size=(100, 100), threshold=100, out=None):
 
-        return filtered_image
+        return self.block_filter(image, block_size, threshold, out)
 
     #############################################################################################
     # Name : thicken_image
     # Function : Dilates an image thereby making the white portions of the image thicker
     #############################################################################################
 
-    def thicken_image(self, image, kernel_size=50):
+    def thicken_image(self, image, kernel_size=50, out=None):
 
         kernel = np.ones((kernel_size, kernel_size), np.uint8)
         # Perform dilation on the binary image
-        thickened_image = cv2.dilate(image, kernel, iterations=1)
+        thickened_image = cv2.dilate(image, kernel, dst=out, iterations=1)
 
         return thickened_image
 
@@ -154,7 +237,13 @@ class Segment:
     # Function : Subtracts white pixels of an image from a list of image masks
     #############################################################################################
 
-    def subtract_image(self, image,  image_masks):
+    def subtract_image(self, image,  image_masks, out=None):
+
+        if out is not None:
+            cv2.subtract(image, image_masks[0], dst=out)
+            for mask in image_masks[1:]:
+                cv2.subtract(out, mask, dst=out)
+            return out
 
         subtracted_image = image.copy()
         for mask in image_masks:
@@ -163,85 +252,502 @@ class Segment:
 
     #############################################################################################
     # Name : apply_mask
-    # Function : applies the red, blue and green masks to an image
+    # Function : applies the green, red and blue masks to the crop row pixels of an image, later
+    #            masks taking precedence. crop_pixel_mask is the result of crop_pixels for the
+    #            image and is computed if not given. With out (which may be bgr_image) the image
+    #            is painted in strips of rows, computing crop_pixel_mask per strip
     #############################################################################################
 
-    def apply_mask(self, bgr_image, masks):
+    def apply_mask(self, bgr_image, masks, crop_pixel_mask=None, out=None):
+
+        if out is not None:
+            if out is not bgr_image:
+                np.copyto(out, bgr_image)
+            for row in range(0, out.shape[0], self.strip_rows):
+                strip = out[row:row + self.strip_rows]
+                if crop_pixel_mask is None:
+                    strip_mask = self.crop_pixels(strip)
+                else:
+                    strip_mask = crop_pixel_mask[row:row + self.strip_rows]
+                for mask, colour in zip(masks, [(0, 255, 0), (0, 0, 255), (255, 0, 0)]):
+                    strip[strip_mask & (mask[row:row + self.strip_rows] == 255)] = colour
+            return out
+
+        if crop_pixel_mask is None:
+            crop_pixel_mask = self.crop_pixels(bgr_image)
+
         image = bgr_image.copy()
-        for y in range(image.shape[0]):
-            for x in range(image.shape[1]):
-                # Get the RGB values of the pixel
-                b, g, r = image[y, x]
+        for mask, colour in zip(masks, [(0, 255, 0), (0, 0, 255), (255, 0, 0)]):
+            image[crop_pixel_mask & (mask == 255)] = colour
+
+        return image
+
+    #############################################################################################
+    # Name : run_stage
+    # Function : computes a stage output with compute() and stores it as the attribute name.
+    #            With a cache the output is looked up by the stage name, its parameters and the
+    #            keys of the attributes it is computed from, and only computed on a miss. With
+    #            stats enabled the stage is measured, and its record notes whether it was cached.
+    #            concurrent=True means other stages run on other threads meanwhile
+    #############################################################################################
 
-                # Check if all RGB values are above 100
-                if r > 100 and g > 100 and b > 100 and (r >= g) and (g/b < 1.2):
-                    # Make the pixel white
+    def run_stage(self, name, parameters, inputs, compute, concurrent=False):
 
-                    if masks[0][y, x] == 255:
-                        image[y, x] = (0, 255, 0)
+        self.log(self.stage_messages[name])
 
-                    if masks[1][y, x] == 255:
-                        image[y, x] = (0, 0, 255)
+        # set if the output is computed rather than read from the cache
+        computed = []
 
-                    if masks[2][y, x] == 255:
-                        image[y, x] = (255, 0, 0)
+        def stage():
+            computed.append(True)
+            return compute()
 
-        return image
+        if self.cache is not None:
+            run = lambda: self.run_cached_stage(name, parameters, inputs, stage)
+        else:
+            run = stage
+
+        if self.stats is None:
+            output = run()
+        else:
+            output, record = self.stats.measure(name, run, concurrent)
+            record['cached'] = not computed
+
+        setattr(self, name, output)
+        return output
+
+    #############################################################################################
+    # Name : run_stages
+    # Function : runs a list of (name, parameters, inputs, compute) stages with run_stage. With
+    #            more than one worker every stage is started on a thread pool as soon as the
+    #            stages of its inputs are done, so independent branches run at the same time
+    #            (OpenCV and NumPy release the GIL). The stage times of the stats then overlap,
+    #            and their memory is not traced
+    #############################################################################################
+
+    def run_stages(self, stages):
+
+        if self.workers <= 1:
+            for stage in stages:
+                self.run_stage(*stage)
+            return
+
+        done = {'original_image'}
+        pending = list(stages)
+        running = {}
+        with ThreadPoolExecutor(self.workers) as executor:
+            while pending or running:
+                for stage in [stage for stage in pending if done.issuperset(stage[2])]:
+                    pending.remove(stage)
+                    running[executor.submit(self.run_stage, *stage, concurrent=True)] = stage[0]
+                if not running:
+                    raise ValueError("stages %s have inputs which no stage computes"
+                                     % ", ".join(stage[0] for stage in pending))
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                    done.add(running.pop(future))
+
+    #############################################################################################
+    # Name : run_buffer_stage
+    # Function : computes a stage of the low memory pipeline, which writes to a buffer shared
+    #            with other stages and so is neither cached nor stored as an attribute
+    #############################################################################################
+
+    def run_buffer_stage(self, name, compute):
+
+        self.log(self.stage_messages[name])
+        if self.stats is None:
+            return compute()
+        output, record = self.stats.measure(name, compute)
+        record['cached'] = False
+        return output
+
+    #############################################################################################
+    # Name : run_cached_stage
+    # Function : returns a stage output from the cache, computing and storing it on a miss, and
+    #            keeps its key for the stages computed from it
+    #############################################################################################
+
+    def run_cached_stage(self, name, parameters, inputs, compute):
+
+        if 'original_image' not in self.keys:
+            self.keys['original_image'] = hash_array(self.original_image)
+        self.keys[name], output = self.cache.run(
+            name, parameters, [self.keys[i] for i in inputs], compute)
+        return output
+
+    #############################################################################################
+    # Name : mask_stages
+    # Function : returns the stages of the pipeline up to the crop row masks for run_stages. The
+    #            vertical and horizontal branches only meet again at diagonal_edges. The block
+    #            sizes are (height, width) and the thresholds counts of white pixels per block
+    #############################################################################################
+
+    def mask_stages(self, edge_threshold=18, vertical_block_size=(20, 3),
+                    horizontal_block_size=(3, 20), noise_block_size=(100, 100),
+                    noise_threshold=100, kernel_size=50, diagonal_kernel_size=15,
+                    thinning_type=cv2.ximgproc.THINNING_ZHANGSUEN):
+
+        noise = {'block_size': noise_block_size, 'threshold': noise_threshold}
+
+        return [
+            ('binary_image', {}, ['original_image'],
+             lambda: self.create_binary_image(self.original_image)),
+
+            ('thin_image', {'thinning_type': thinning_type}, ['binary_image'],
+             lambda: self.thinning_image(self.binary_image, thinning_type)),
+
+            ('vertical_edges', {'block_size': vertical_block_size, 'threshold': edge_threshold},
+             ['thin_image'],
+             lambda: self.extract_edges(self.thin_image, "vertical", vertical_block_size, edge_threshold)),
+
+            ('filtered_vertical_edges', noise, ['vertical_edges'],
+             lambda: self.remove_noise(self.vertical_edges, noise_block_size, noise_threshold)),
+
+            ('vertical_edges_mask', {'kernel_size': kernel_size}, ['filtered_vertical_edges'],
+             lambda: self.thicken_image(self.filtered_vertical_edges, kernel_size)),
+
+            ('horizontal_edges', {'block_size': horizontal_block_size, 'threshold': edge_threshold},
+             ['thin_image'],
+             lambda: self.extract_edges(self.thin_image, "horizontal", horizontal_block_size, edge_threshold)),
+
+            ('filtered_horizontal_edges', noise, ['horizontal_edges'],
+             lambda: self.remove_noise(self.horizontal_edges, noise_block_size, noise_threshold)),
+
+            ('horizontal_edges_mask', {'kernel_size': kernel_size}, ['filtered_horizontal_edges'],
+             lambda: self.thicken_image(self.filtered_horizontal_edges, kernel_size)),
+
+            ('diagonal_edges', {}, ['thin_image', 'vertical_edges_mask', 'horizontal_edges_mask'],
+             lambda: self.subtract_image(self.thin_image, [self.vertical_edges_mask, self.horizontal_edges_mask])),
+
+            ('filtered_diagonal_edges', noise, ['diagonal_edges'],
+             lambda: self.remove_noise(self.diagonal_edges, noise_block_size, noise_threshold)),
+
+            ('diagonal_edges_mask', {'kernel_size': diagonal_kernel_size}, ['filtered_diagonal_edges'],
+             lambda: self.thicken_image(self.filtered_diagonal_edges, diagonal_kernel_size)),
+        ]
+
+    #############################################################################################
+    # Name : create_masks
+    # Function : runs the image processing pipeline up to the crop row masks and returns them
+    #            as [diagonal, vertical, horizontal] edges masks. parameters are passed on to
+    #            mask_stages
+    #############################################################################################
+
+    def create_masks(self, **parameters):
+
+        self.run_stages(self.mask_stages(**parameters))
+
+        return [self.diagonal_edges_mask, self.vertical_edges_mask, self.horizontal_edges_mask]
+
+    #############################################################################################
+    # Name : create_final_image
+    # Function : runs the whole pipeline and returns the original image with the masks applied
+    #            to its crop row pixels. parameters are passed on to mask_stages
+    #############################################################################################
+
+    def create_final_image(self, **parameters):
+
+        final_stage = ('final_image', {}, ['original_image', 'binary_image', 'diagonal_edges_mask',
+                                           'vertical_edges_mask', 'horizontal_edges_mask'],
+                       lambda: self.apply_mask(
+                           self.original_image,
+                           [self.diagonal_edges_mask, self.vertical_edges_mask, self.horizontal_edges_mask],
+                           self.binary_image[:, :, 0] != 0))
+
+        self.run_stages(self.mask_stages(**parameters) + [final_stage])
+        return self.final_image
+
+    #############################################################################################
+    # Name : create_final_image_low_memory
+    # Function : runs the same pipeline as create_final_image, with the same parameters and
+    #            result, through four (height, width) buffers instead of one array per stage:
+    #            scratch holds the binary image and later the edges being filtered, thin holds
+    #            the thin image and later the diagonal edges mask, and the vertical and
+    #            horizontal edges masks have their own. The filters and the painting work in
+    #            strips of rows, and the final image is painted into a buffer of its own, so the
+    #            original image stays intact for later runs. The stage cache is not used, and the
+    #            stages run one after the other whatever the number of workers
+    #############################################################################################
+
+    def create_final_image_low_memory(self, edge_threshold=18, vertical_block_size=(20, 3),
+                                      horizontal_block_size=(3, 20), noise_block_size=(100, 100),
+                                      noise_threshold=100, kernel_size=50, diagonal_kernel_size=15,
+                                      thinning_type=cv2.ximgproc.THINNING_ZHANGSUEN):
+
+        image = self.original_image
+        scratch = np.empty(image.shape[:2], np.uint8)
+        vertical_edges_mask = np.empty_like(scratch)
+        horizontal_edges_mask = np.empty_like(scratch)
+
+        self.run_buffer_stage('binary_image', lambda: self.create_binary_image(image, out=scratch))
+        # thinning ignores dst, so thin is the one buffer it allocates
+        thin = self.run_buffer_stage('thin_image', lambda: self.thinning_image(scratch, thinning_type))
+
+        self.run_buffer_stage('vertical_edges', lambda: self.extract_edges(
+            thin, "vertical", vertical_block_size, edge_threshold, out=scratch))
+        self.run_buffer_stage('filtered_vertical_edges', lambda: self.remove_noise(
+            scratch, noise_block_size, noise_threshold, out=scratch))
+        self.run_buffer_stage('vertical_edges_mask', lambda: self.thicken_image(
+            scratch, kernel_size, out=vertical_edges_mask))
+
+        self.run_buffer_stage('horizontal_edges', lambda: self.extract_edges(
+            thin, "horizontal", horizontal_block_size, edge_threshold, out=scratch))
+        self.run_buffer_stage('filtered_horizontal_edges', lambda: self.remove_noise(
+            scratch, noise_block_size, noise_threshold, out=scratch))
+        self.run_buffer_stage('horizontal_edges_mask', lambda: self.thicken_image(
+            scratch, kernel_size, out=horizontal_edges_mask))
+
+        self.run_buffer_stage('diagonal_edges', lambda: self.subtract_image(
+            thin, [vertical_edges_mask, horizontal_edges_mask], out=scratch))
+        self.run_buffer_stage('filtered_diagonal_edges', lambda: self.remove_noise(
+            scratch, noise_block_size, noise_threshold, out=scratch))
+        diagonal_edges_mask = self.run_buffer_stage('diagonal_edges_mask', lambda: self.thicken_image(
+            scratch, diagonal_kernel_size, out=thin))
+
+        final_image = np.empty(image.shape, np.uint8)
+        masks = [diagonal_edges_mask, vertical_edges_mask, horizontal_edges_mask]
+        self.final_image = self.run_buffer_stage(
+            'final_image', lambda: self.apply_mask(image, masks, out=final_image))
+        return self.final_image
+
+    #############################################################################################
+    # Name : preview_parameters
+    # Function : returns the mask_stages parameters for an image downscaled by scale. Block and
+    #            kernel sizes shrink with the image. The thresholds follow the rounded blocks:
+    #            an edge crossing a block has as many pixels as the side along it, so the edge
+    #            threshold keeps its fraction of that side, and the noise threshold keeps its
+    #            density of skeleton pixels per block area, which grows by 1 / scale since the
+    #            skeleton stays one pixel wide. Zhang-Suen thinning breaks the narrow diagonal
+    #            rows of a downscaled image into dots, so the preview thins with Guo-Hall, whose
+    #            skeleton keeps the density of the full resolution one in every direction
+    #############################################################################################
+
+    def preview_parameters(self, scale, edge_threshold=18, vertical_block_size=(20, 3),
+                           horizontal_block_size=(3, 20), noise_block_size=(100, 100),
+                           noise_threshold=100, kernel_size=50, diagonal_kernel_size=15,
+                           thinning_type=cv2.ximgproc.THINNING_GUOHALL):
+
+        def size(pixels):
+            return max(1, int(round(pixels * scale)))
+
+        vertical_block = tuple(size(pixels) for pixels in vertical_block_size)
+        horizontal_block = tuple(size(pixels) for pixels in horizontal_block_size)
+        noise_block = tuple(size(pixels) for pixels in noise_block_size)
+
+        # one threshold serves both directions, so take the side that shrank the most
+        edge_ratio = min(vertical_block[0] / vertical_block_size[0],
+                         horizontal_block[1] / horizontal_block_size[1])
+        area_ratio = noise_block[0] * noise_block[1] / (noise_block_size[0] * noise_block_size[1])
+
+        return {'edge_threshold': edge_threshold * edge_ratio,
+                'vertical_block_size': vertical_block,
+                'horizontal_block_size': horizontal_block,
+                'noise_block_size': noise_block,
+                'noise_threshold': noise_threshold * area_ratio / scale,
+                'kernel_size': size(kernel_size),
+                'diagonal_kernel_size': size(diagonal_kernel_size),
+                'thinning_type': thinning_type}
+
+    #############################################################################################
+    # Name : create_preview
+    # Function : runs the mask stages on the image downscaled by scale, with preview_parameters,
+    #            upscales the masks to the full image and applies them to its crop row pixels.
+    #            This is much faster than create_final_image and close to it, since the masks
+    #            are coarse, but not the same. parameters are the full resolution ones. The
+    #            full resolution masks are kept as attributes like in create_final_image. On
+    #            diagonal rows the preview is unreliable, so it warns when the diagonal mask
+    #            dominates
+    #############################################################################################
+
+    def create_preview(self, scale=0.25, **parameters):
+
+        if not 0 < scale <= 1:
+            raise ValueError("scale must be in (0, 1]")
+
+        image_height, image_width = self.original_image.shape[:2]
+        small_size = (max(1, int(round(image_width * scale))), max(1, int(round(image_height * scale))))
+        small_image = self.run_buffer_stage('downscale_image', lambda: cv2.resize(
+            np.asarray(self.original_image), small_size, interpolation=cv2.INTER_AREA))
+
+        preview = Segment(self.filename, verbose=self.verbose, image=small_image, cache=self.cache,
+                          workers=self.workers)
+        preview.stats = self.stats
+        masks = preview.create_masks(**self.preview_parameters(scale, **parameters))
+
+        mask_pixels = [cv2.countNonZero(mask) for mask in masks]
+        if mask_pixels[0] > self.preview_diagonal_share * max(sum(mask_pixels), 1):
+            warnings.warn("the diagonal mask holds %d%% of the mask pixels and the preview misses "
+                          "much of the diagonal rows, run without the preview for reliable masks"
+                          % round(100 * mask_pixels[0] / sum(mask_pixels)))
+
+        def upscale_masks():
+            return [cv2.resize(mask, (image_width, image_height), interpolation=cv2.INTER_NEAREST)
+                    for mask in masks]
+
+        masks = self.run_buffer_stage('upscale_masks', upscale_masks)
+        self.diagonal_edges_mask, self.vertical_edges_mask, self.horizontal_edges_mask = masks
+
+        self.final_image = self.run_buffer_stage(
+            'final_image', lambda: self.apply_mask(self.original_image, masks))
+        return self.final_image
 
     #############################################################################################
     # Name : execute
-    # Function : executes the image processing pipeline
+    # Function : executes the image processing pipeline and writes the final image to
+    #            output_path. parameters are passed on to create_masks. low_memory runs
+    #            create_final_image_low_memory instead, and a scale below 1 create_preview
     #############################################################################################
 
-    def execute(self):
+    def execute(self, output_path="final_image.jpg", low_memory=False, scale=1.0, **parameters):
 
-        print("Creating Binary image...")
-        self.binary_image = self.create_binary_image(self.original_image)
+        if scale != 1.0:
+            if low_memory:
+                raise ValueError("the preview does not have a low memory pipeline")
+            self.create_preview(scale, **parameters)
+        elif low_memory:
+            if self.cache is not None:
+                raise ValueError("the low memory pipeline does not use the stage cache")
+            self.create_final_image_low_memory(**parameters)
+        else:
+            self.create_final_image(**parameters)
 
-        print("Thinning the Binary image...")
-        self.thin_image = self.thinning_image(self.binary_image)
+        self.log(self.stage_messages['write_image'])
+        if self.stats is None:
+            written = cv2.imwrite(output_path, self.final_image)
+        else:
+            written, _ = self.stats.measure('write_image',
+                                            lambda: cv2.imwrite(output_path, self.final_image))
+        if not written:
+            raise ValueError("could not write image " + output_path)
+        self.log("Final image created as " + output_path)
 
-        print("Extracting vertical edges...")
-        self.vertical_edges = self.extract_edges(self.thin_image, "vertical")
 
-        print("De-noising vertical edges...")
-        self.filtered_vertical_edges = self.remove_noise(self.vertical_edges)
+    #############################################################################################
+    # Name : minimum_halo
+    # Function : returns the smallest halo of execute_tiled which leaves the result unchanged
+    #            for the given mask_stages parameters, as far as thinning_reach holds. A change
+    #            at the edge of a window reaches thinning_reach pixels into the thin image. Every block filter widens it to
+    #            whole blocks and every dilation by half its kernel size. The result is rounded
+    #            up to a multiple of tile_alignment, which every block size has to divide
+    #############################################################################################
 
-        print("Extracting horizontal edges...")
-        self.horizontal_edges = self.extract_edges(
-            self.thin_image, "horizontal")
+    def minimum_halo(self, edge_threshold=18, vertical_block_size=(20, 3),
+                     horizontal_block_size=(3, 20), noise_block_size=(100, 100),
+                     noise_threshold=100, kernel_size=50, diagonal_kernel_size=15,
+                     thinning_type=cv2.ximgproc.THINNING_ZHANGSUEN):
 
-        print("De-noising horizontal edges...")
-        self.filtered_horizontal_edges = self.remove_noise(
-            self.horizontal_edges)
+        block_sizes = [vertical_block_size, horizontal_block_size, noise_block_size]
+        if any(self.tile_alignment % size for block_size in block_sizes for size in block_size):
+            raise ValueError("block sizes must divide %d for tiled execution" % self.tile_alignment)
 
-        print("Creating vertical edges mask...")
-        self.vertical_edges_mask = self.thicken_image(
-            self.filtered_vertical_edges)
+        # reach as (rows, columns), rounded out to whole blocks by a block filter
+        def blocks(reach, block_size):
+            return [-(-pixels // size) * size for pixels, size in zip(reach, block_size)]
 
-        print("Creating horizontal edges mask...")
-        self.horizontal_edges_mask = self.thicken_image(
-            self.filtered_horizontal_edges)
+        thin = [self.thinning_reach, self.thinning_reach]
+        vertical = [pixels + kernel_size // 2 for pixels in
+                    blocks(blocks(thin, vertical_block_size), noise_block_size)]
+        horizontal = [pixels + kernel_size // 2 for pixels in
+                      blocks(blocks(thin, horizontal_block_size), noise_block_size)]
+        diagonal = [pixels + diagonal_kernel_size // 2 for pixels in
+                    blocks(np.maximum(np.maximum(thin, vertical), horizontal).tolist(), noise_block_size)]
 
-        print("Extracting diagonal edges...")
-        self.diagonal_edges = self.subtract_image(
-            self.thin_image, [self.vertical_edges_mask, self.horizontal_edges_mask])
+        reach = max(vertical + horizontal + diagonal)
+        return -(-reach // self.tile_alignment) * self.tile_alignment
 
-        print("De-noising diagonal edges...")
-        self.filtered_diagonal_edges = self.remove_noise(self.diagonal_edges)
+    #############################################################################################
+    # Name : execute_tiled
+    # Function : executes the image processing pipeline tile by tile and writes the final image
+    #            to a .npy file at output_path, which is memory mapped so that only one tile is
+    #            in memory at a time. Every tile is processed in a window grown by halo pixels
+    #            on each side, and only the tile itself is kept. The halo has to cover how far
+    #            the edge of a window can change the result, see minimum_halo, and a smaller
+    #            one raises ValueError. Peak memory is set by (tile_size + 2 * halo) ** 2. With
+    #            stats enabled the stage records of every tile are kept with its tile origin.
+    #            low_memory runs every tile through create_final_image_low_memory
+    #############################################################################################
 
-        print("Creating diagonal edges mask...")
-        self.diagonal_edges_mask = self.thicken_image(
-            self.filtered_diagonal_edges, kernel_size=15)
+    def execute_tiled(self, output_path, tile_size=3000, halo=600, low_memory=False, **parameters):
+
+        if tile_size <= 0 or tile_size % self.tile_alignment or halo % self.tile_alignment:
+            raise ValueError("tile_size and halo must be multiples of %d" % self.tile_alignment)
+        minimum_halo = self.minimum_halo(**parameters)
+        if halo < minimum_halo:
+            raise ValueError("halo must be at least %d for these parameters" % minimum_halo)
+        if low_memory and self.cache is not None:
+            raise ValueError("the low memory pipeline does not use the stage cache")
+
+        image_height, image_width = self.original_image.shape[:2]
+        final_image = np.lib.format.open_memmap(output_path, mode='w+', dtype=np.uint8,
+                                                shape=(image_height, image_width, 3))
+
+        for y in range(0, image_height, tile_size):
+            for x in range(0, image_width, tile_size):
+                self.log("Segmenting tile at x=%d y=%d..." % (x, y))
+
+                # window of the tile and its halo, clipped to the image
+                y0, y1 = max(y - halo, 0), min(y + tile_size + halo, image_height)
+                x0, x1 = max(x - halo, 0), min(x + tile_size + halo, image_width)
+                window = np.ascontiguousarray(self.original_image[y0:y1, x0:x1])
+
+                segment = Segment(self.filename, verbose=False, image=window, cache=self.cache,
+                                  workers=self.workers)
+                segment.stats = self.stats
+                first_record = len(self.stats.records) if self.stats is not None else 0
+                if low_memory:
+                    tile_image = segment.create_final_image_low_memory(**parameters)
+                else:
+                    tile_image = segment.create_final_image(**parameters)
+                if self.stats is not None:
+                    for record in self.stats.records[first_record:]:
+                        record['tile'] = [x, y]
 
-        print("Applying masks to the original image...")
-        self.final_image = self.apply_mask(self.original_image, [
-                                           self.diagonal_edges_mask, self.vertical_edges_mask, self.horizontal_edges_mask])
+                height = min(tile_size, image_height - y)
+                width = min(tile_size, image_width - x)
+                final_image[y:y + height, x:x + width] = \
+                    tile_image[y - y0:y - y0 + height, x - x0:x - x0 + width]
 
-        print("Final image created as final_image.jpg")
-        cv2.imwrite("final_image"+".jpg", self.final_image)
+        final_image.flush()
+        self.log("Final image created as " + output_path)
+        return final_image
 
 
 if __name__ == "__main__":
 
-    Segment("field.jpg").execute()
+    parser = argparse.ArgumentParser(description='Segment the crop rows of a field image')
+    parser.add_argument('image', nargs='?', default='field.jpg', help='image or (height, width, 3) .npy file')
+    parser.add_argument('-o', '--output', help='output image (default: final_image.jpg, or final_image.npy with --tiled)')
+    parser.add_argument('--tiled', action='store_true', help='process in tiles and write a memory mapped .npy')
+    parser.add_argument('--tile-size', type=int, default=3000, help='tile size in pixels (multiple of 300)')
+    parser.add_argument('--halo', type=int, default=600, help='tile overlap in pixels (multiple of 300, at least Segment.minimum_halo)')
+    parser.add_argument('--cache', help='directory of the stage output cache')
+    parser.add_argument('--cache-size', type=float, default=2048, help='cache size bound in MiB')
+    parser.add_argument('--stats', metavar='FILE', help='write the time and memory of every stage to a JSON report')
+    parser.add_argument('--low-memory', action='store_true',
+                        help='reuse a few scratch buffers instead of keeping every stage output')
+    parser.add_argument('--threads', type=int, default=1, help='threads running independent stages at once')
+    parser.add_argument('--preview', type=float, metavar='SCALE',
+                        help='fast preview computing the masks at this scale of the image, e.g. 0.25')
+    args = parser.parse_args()
+
+    if args.low_memory and args.cache:
+        parser.error("--low-memory does not use the stage cache")
+    if args.preview is not None and (args.tiled or args.low_memory):
+        parser.error("--preview cannot be combined with --tiled or --low-memory")
+
+    cache = StageCache(args.cache, int(args.cache_size * 2 ** 20)) if args.cache else None
+    segment = Segment(args.image, cache=cache, workers=args.threads)
+    if args.stats:
+        segment.enable_stats()
+    if args.tiled:
+        segment.execute_tiled(args.output or "final_image.npy", args.tile_size, args.halo, args.low_memory)
+    else:
+        segment.execute(args.output or "final_image.jpg", args.low_memory, args.preview or 1.0)
+    if cache is not None:
+        print("Stage cache: %d hits, %d misses" % (cache.hits, cache.misses))
+    if args.stats:
+        segment.stats.write(args.stats)
+        print("Stage report written to " + args.stats)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+#############################################################################################
+# File : stage_cache.py
+# Function : Content addressed on-disk cache for the outputs of the segmentation stages. The
+#            key of a stage output is a hash of the stage name, its parameters and the keys of
+#            its inputs, and the key of the input image is a hash of its pixels. Changing a
+#            parameter therefore changes the keys of that stage and every stage downstream of
+#            it only. Outputs are stored as .npy files and loaded memory mapped, and the least
+#            recently used files are evicted once the cache grows past its size bound.
+#############################################################################################
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# part of every key, bump it when a stage changes its output for the same parameters
+CACHE_VERSION = 1
+
+
+#############################################################################################
+# Name : hash_array
+# Function : returns a hex digest of the shape, dtype and contents of an array, read in chunks
+#            of rows so that memory mapped images are not loaded at once
+#############################################################################################
+
+def hash_array(array, chunk_rows=1024):
+
+    digest = hashlib.sha256()
+    digest.update(repr((array.shape, array.dtype.str)).encode())
+    for row in range(0, array.shape[0], chunk_rows):
+        digest.update(np.ascontiguousarray(array[row:row + chunk_rows]).data)
+    return digest.hexdigest()
+
+
+#############################################################################################
+# Name : StageCache
+# Function : Directory of <key>.npy files holding at most max_bytes. The modification time of a
+#            file is its last use, so eviction removes the files with the oldest times first
+#############################################################################################
+
+class StageCache:
+
+    def __init__(self, directory, max_bytes=2 * 2 ** 30):
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    #############################################################################################
+    # Name : key
+    # Function : returns the key of a stage output from the stage name, a dict of parameters
+    #            and the keys of the inputs
+    #############################################################################################
+
+    def key(self, stage, parameters, input_keys):
+        text = json.dumps([CACHE_VERSION, stage, parameters, list(input_keys)], sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    #############################################################################################
+    # Name : path
+    # Function : returns the file of a key
+    #############################################################################################
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    #############################################################################################
+    # Name : get
+    # Function : returns the memory mapped array of a key, or None if it is not cached
+    #############################################################################################
+
+    def get(self, key):
+
+        path = self.path(key)
+        try:
+            array = np.load(path, mmap_mode='r')
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            # missing, or removed by another process while being opened
+            return None
+        return array
+
+    #############################################################################################
+    # Name : put
+    # Function : stores an array under a key and evicts old files if the cache is too large. The
+    #            file is written under a temporary name first so that readers never see a
+    #            partial file
+    #############################################################################################
+
+    def put(self, key, array):
+
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as f:
+            np.save(f, array)
+        os.replace(temporary, self.path(key))
+        self.evict(keep=key)
+
+    #############################################################################################
+    # Name : evict
+    # Function : removes the least recently used files until the cache fits in max_bytes. The
+    #            file of keep is never removed
+    #############################################################################################
+
+    def evict(self, keep=None):
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, name, stat.st_size))
+            total += stat.st_size
+
+        entries.sort()
+        for _, name, size in entries:
+            if total <= self.max_bytes:
+                break
+            if name == str(keep) + '.npy':
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    #############################################################################################
+    # Name : run
+    # Function : returns (key, output) of a stage, loading the output from the cache or
+    #            computing it with compute() and storing it
+    #############################################################################################
+
+    def run(self, stage, parameters, input_keys, compute):
+
+        key = self.key(stage, parameters, input_keys)
+        output = self.get(key)
+        if output is not None:
+            self.hits += 1
+            return key, output
+
+        self.misses += 1
+        output = compute()
+        self.put(key, output)
+        return key, output
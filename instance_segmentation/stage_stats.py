@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+#############################################################################################
+# File : stage_stats.py
+# Function : Opt-in instrumentation of the segmentation stages. Records wall time, CPU time and
+#            peak traced memory of every stage, writes them as a JSON report per image and
+#            aggregates reports across a batch. Nothing in this file runs unless
+#            Segment.enable_stats is called
+#############################################################################################
+
+import json
+import time
+import tracemalloc
+
+
+#############################################################################################
+# Name : StageStats
+# Function : Collects one record per stage of an image: {'stage': name, 'wall_ms': ...,
+#            'cpu_ms': ..., 'peak_kib': ...}. peak_kib is the peak memory allocated during the
+#            stage above what was allocated when it started, as traced by tracemalloc (which
+#            sees NumPy and OpenCV arrays). Tracing is only on while a stage runs, so the
+#            rest of the process is not slowed down. The traced peak is shared by the whole
+#            process, so stages running on threads at the same time get a peak_kib of None.
+#            CPU time counts all threads of the process
+#############################################################################################
+
+class StageStats:
+
+    def __init__(self, trace_memory=True):
+
+        self.trace_memory = trace_memory
+        self.records = []
+        self.image = None
+        self.shape = None
+
+    #############################################################################################
+    # Name : measure
+    # Function : calls fn, appends the record of the stage name and returns (output, record).
+    #            concurrent=True means other stages may run on other threads meanwhile, so the
+    #            memory is not traced. Tracing is started for the stage and stopped after it,
+    #            unless it was already on
+    #############################################################################################
+
+    def measure(self, name, fn, concurrent=False):
+
+        trace = self.trace_memory and not concurrent
+        started = False
+        if trace:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            allocated = tracemalloc.get_traced_memory()[0]
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        try:
+            output = fn()
+        finally:
+            wall_ms = 1000.0 * (time.perf_counter() - wall_start)
+            cpu_ms = 1000.0 * (time.process_time() - cpu_start)
+            if trace:
+                peak = tracemalloc.get_traced_memory()[1] - allocated
+            if started:
+                tracemalloc.stop()
+
+        record = {'stage': name, 'wall_ms': round(wall_ms, 3), 'cpu_ms': round(cpu_ms, 3)}
+        if self.trace_memory:
+            record['peak_kib'] = round(peak / 1024, 1) if trace else None
+        self.records.append(record)
+        return output, record
+
+    #############################################################################################
+    # Name : report
+    # Function : returns the records of an image with their totals
+    #############################################################################################
+
+    def report(self):
+
+        total = {'wall_ms': round(sum(r['wall_ms'] for r in self.records), 3),
+                 'cpu_ms': round(sum(r['cpu_ms'] for r in self.records), 3)}
+        if self.trace_memory:
+            peaks = [r['peak_kib'] for r in self.records if r['peak_kib'] is not None]
+            total['peak_kib'] = max(peaks) if peaks else None
+
+        return {'image': self.image, 'shape': self.shape, 'stages': self.records, 'total': total}
+
+    #############################################################################################
+    # Name : write
+    # Function : writes the report to a JSON file
+    #############################################################################################
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+#############################################################################################
+# Name : summarize
+# Function : aggregates the reports of many images into per stage count, total, mean and max
+#            wall and CPU time, the max peak memory (of the records which have one) and the
+#            number of cache hits
+#############################################################################################
+
+def summarize(reports):
+
+    stages = {}
+    for report in reports:
+        for record in report['stages']:
+            stage = stages.setdefault(record['stage'], {'count': 0, 'cached': 0,
+                                                        'wall_ms': [], 'cpu_ms': [], 'peak_kib': []})
+            stage['count'] += 1
+            stage['cached'] += int(record.get('cached', False))
+            for field in ('wall_ms', 'cpu_ms', 'peak_kib'):
+                if record.get(field) is not None:
+                    stage[field].append(record[field])
+
+    summary = {}
+    for name, stage in stages.items():
+        summary[name] = {'count': stage['count'], 'cached': stage['cached']}
+        for field in ('wall_ms', 'cpu_ms'):
+            values = stage[field]
+            summary[name]['total_' + field] = round(sum(values), 3)
+            summary[name]['mean_' + field] = round(sum(values) / len(values), 3)
+            summary[name]['max_' + field] = round(max(values), 3)
+        if stage['peak_kib']:
+            summary[name]['max_peak_kib'] = max(stage['peak_kib'])
+
+    return {'images': len(reports), 'stages': summary}
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+#############################################################################################
+# File : synthetic_field.py
+# Function : Generates synthetic crop row images for testing and benchmarking segment.py. Rows
+#            of plants in a crop colour which passes Segment.crop_pixels run over soil which
+#            does not, in a vertical, horizontal or diagonal direction, or in all three side by
+#            side, with gaps between the plants, Gaussian pixel noise and scattered weed
+#            pixels. The same seed always gives the same image. Images are generated in strips
+#            of rows, so large ones do not need more memory than the image itself.
+#
+# Usage : python3 synthetic_field.py field.png --size 3000 4000 --orientation diagonal
+#############################################################################################
+
+import argparse
+
+import cv2
+import numpy as np
+
+# direction of the rows in degrees from the image x axis (image y runs downwards)
+ORIENTATIONS = {'horizontal': 0.0, 'diagonal': 45.0, 'vertical': 90.0}
+
+# a field of vertical, horizontal and diagonal rows in three bands of columns, left to right
+MIXED = 'mixed'
+MIXED_ORIENTATIONS = ['vertical', 'horizontal', 'diagonal']
+
+# BGR colours of the plants and the soil
+CROP_COLOUR = (160, 170, 190)
+SOIL_COLOUR = (60, 90, 120)
+
+# rows generated at a time
+STRIP_ROWS = 256
+
+
+#############################################################################################
+# Name : make_field
+# Function : returns a (height, width, 3) BGR uint8 image of crop rows. row_spacing is the
+#            distance between row centres and row_width the width of a row, plant_length and
+#            gap_length the lengths of the plants and the gaps along a row, all in pixels.
+#            noise is the standard deviation of the pixel noise and weeds the fraction of
+#            pixels set to the crop colour at random. orientation is one of ORIENTATIONS or
+#            MIXED
+#############################################################################################
+
+def make_field(height, width, orientation='vertical', row_spacing=80, row_width=16,
+               plant_length=150, gap_length=10, noise=4.0, weeds=0.001, seed=0):
+
+    if orientation != MIXED and orientation not in ORIENTATIONS:
+        raise ValueError("orientation must be one of " + ", ".join(sorted(ORIENTATIONS) + [MIXED]))
+
+    rng = np.random.default_rng(seed)
+    if orientation == MIXED:
+        # angle of every column, in equal bands
+        band = np.arange(width) * len(MIXED_ORIENTATIONS) // width
+        angle = np.radians([ORIENTATIONS[name] for name in MIXED_ORIENTATIONS])[band][np.newaxis, :]
+    else:
+        angle = np.radians(ORIENTATIONS[orientation])
+    cos, sin = np.cos(angle), np.sin(angle)
+    period = plant_length + gap_length
+
+    # every row starts its plants at a random offset
+    row_count = int(np.hypot(height, width) // row_spacing) + 3
+    phases = rng.uniform(0, period, row_count)
+
+    crop_colour = np.array(CROP_COLOUR, np.float32)
+    soil_colour = np.array(SOIL_COLOUR, np.float32)
+    x = np.arange(width, dtype=np.float64)[np.newaxis, :]
+
+    image = np.empty((height, width, 3), np.uint8)
+    for row in range(0, height, STRIP_ROWS):
+        y = np.arange(row, min(row + STRIP_ROWS, height), dtype=np.float64)[:, np.newaxis]
+
+        # position across and along the rows
+        across = y * cos - x * sin
+        along = x * cos + y * sin
+        row_index = np.floor(across / row_spacing).astype(np.int64)
+        in_row = across - row_index * row_spacing < row_width
+        in_plant = (along + phases[row_index % row_count]) % period < plant_length
+
+        strip = np.where((in_row & in_plant)[:, :, np.newaxis], crop_colour, soil_colour)
+        if noise > 0:
+            strip += rng.normal(0.0, noise, strip.shape).astype(np.float32)
+        np.clip(strip, 0, 255, out=strip)
+        image[row:row + len(y)] = strip
+
+    if weeds > 0:
+        count = int(weeds * height * width)
+        image[rng.integers(0, height, count), rng.integers(0, width, count)] = CROP_COLOUR
+
+    return image
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic crop row image')
+    parser.add_argument('output', help='output image, or .npy for a (height, width, 3) BGR array')
+    parser.add_argument('--size', type=int, nargs=2, default=(1500, 2000), metavar=('HEIGHT', 'WIDTH'),
+                        help='image size in pixels')
+    parser.add_argument('--orientation', choices=sorted(ORIENTATIONS) + [MIXED], default='vertical',
+                        help='row direction, or mixed for all three side by side')
+    parser.add_argument('--row-spacing', type=int, default=80, help='pixels between row centres')
+    parser.add_argument('--row-width', type=int, default=16, help='row width in pixels')
+    parser.add_argument('--noise', type=float, default=4.0, help='standard deviation of the pixel noise')
+    parser.add_argument('--weeds', type=float, default=0.001, help='fraction of random crop coloured pixels')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    field = make_field(args.size[0], args.size[1], args.orientation, args.row_spacing, args.row_width,
+                       noise=args.noise, weeds=args.weeds, seed=args.seed)
+    if args.output.endswith('.npy'):
+        np.save(args.output, field)
+    elif not cv2.imwrite(args.output, field):
+        raise ValueError("could not write image " + args.output)
+    print("Synthetic field of %d x %d pixels written to %s" % (field.shape[1], field.shape[0], args.output))
@@ -6,7 +6,14 @@
 ################################################################################
 
 import math
+import time
 import numpy as np
+from spatial_index import GridIndex
+from occupancy_grid import OccupancyGrid, TiledOccupancyGrid, polygon_bounds
+from tree_store import TreeStore
+from dynamic_occupancy import DynamicOccupancy
+from planner_stats import PlannerStats
+from obstacle_bvh import ObstacleBVH
 
 
 ################################################################################
@@ -16,18 +23,145 @@ import numpy as np
 
 class RRT:
 
+    # statistics collector, None unless enable_stats is called
+    stats = None
+
+    # smallest chunk sample_batch checks together, smaller ones are checked
+    # one sample at a time
+    min_chunk = 4
+
+    # largest (points x nodes) distance matrix nearest_neighbors computes at
+    # once instead of querying the index for every point
+    nn_matrix_size = 32768
+
+    # methods which are timed once statistics are enabled
+    timed_methods = ('nearest_neighbor', 'nearest_neighbors', 'steer', 'steer_nodes', 'get_line_points',
+                     'get_thresholded_node', 'check_node_viability', 'check_nodes_viability',
+                     'repair_tree')
+
+    ################################################################################
+    # Name : enable_stats
+    # Function : starts collecting counters and timers. The timed methods are
+    #            wrapped on this object only, so an RRT without stats runs the
+    #            plain methods. Returns the PlannerStats object
+    ################################################################################
+    def enable_stats(self, keep_history=True):
+        self.disable_stats()
+        self.stats = PlannerStats(keep_history)
+        for name in self.timed_methods:
+            setattr(self, name, self.stats.wrap(name, getattr(self, name)))
+        return self.stats
+
+    ################################################################################
+    # Name : disable_stats
+    # Function : stops collecting statistics and removes the method wrappers
+    ################################################################################
+    def disable_stats(self):
+        for name in self.timed_methods:
+            self.__dict__.pop(name, None)
+        self.stats = None
+
     ################################################################################
     # Name : load_env
     # Function : This function initializes the RRT object and loads important data
+    #            nn_mode selects the nearest neighbor search: 'grid' uses a
+    #            bucketed spatial index and 'linear' scans every node (reference)
+    #            static_check selects the static collision check: 'grid' looks
+    #            up a rasterized occupancy grid (optionally inflated by
+    #            robot_radius) and 'polygon' runs point_in_polygon on every point
+    #            batch_size > 1 makes execute_rrt draw and check that many
+    #            samples at once with NumPy instead of one at a time
+    #            dynamic_horizon > 0 makes the dynamic obstacle checks
+    #            time-aware: new edges, and the edges kept by replan, must be
+    #            clear of the obstacles in the frame and the next
+    #            dynamic_horizon frames, whose cells are built ahead of time
+    #            replan=True makes execute_rrt repair the edges crossed by the
+    #            dynamic obstacles of the frame before expanding the tree
+    #            planner='connect' grows a second tree from the goal and
+    #            greedily connects the two trees (RRT-Connect)
+    #            continuous=True samples real valued co-ordinates and checks
+    #            edges with exact segment tests against a bounding volume
+    #            hierarchy of the static obstacles. The goal is then reached
+    #            within goal_tolerance
+    #            bounds (xmin, xmax, ymin, ymax) is the sampling domain and
+    #            resolution the cell size of the rasterized static obstacles.
+    #            Nodes stay on the integer lattice, so resolution must be 1/n
+    #            for a whole number n: every lattice point is then a grid
+    #            point, and a finer grid only makes robot_radius inflation
+    #            more exact
+    #            occupancy_map is a static obstacle raster (an OccupancyGrid or
+    #            the filename of a .npy written by OccupancyGrid.save_npy) which
+    #            is memory mapped, so only the pages an edge touches are read.
+    #            With map_tile_size its lookups go through a cache of tiles.
+    #            bounds default to the map bounds, or (-5, 15, -5, 15)
     ################################################################################
-    def load_env(self, start_point, goal_point, dynamic_obstacles, static_obstacles):
+    def load_env(self, start_point, goal_point, dynamic_obstacles, static_obstacles,
+                 nn_mode='grid', cell_size=4.0, static_check='grid', robot_radius=0.0,
+                 batch_size=1, dynamic_horizon=0, replan=False, planner='rrt',
+                 continuous=False, goal_tolerance=0.5, bounds=None, resolution=1.0,
+                 step_size=4.0, occupancy_map=None, map_tile_size=None):
+
+        if nn_mode not in ('grid', 'linear'):
+            raise ValueError("nn_mode must be 'grid' or 'linear'")
+        if static_check not in ('grid', 'polygon'):
+            raise ValueError("static_check must be 'grid' or 'polygon'")
+        if static_check == 'polygon' and robot_radius > 0:
+            raise ValueError("robot_radius requires static_check='grid'")
+        if planner not in ('rrt', 'connect'):
+            raise ValueError("planner must be 'rrt' or 'connect'")
+        if planner == 'connect' and (batch_size > 1 or replan):
+            raise ValueError("planner='connect' does not support batch_size or replan")
+        if continuous and (batch_size > 1 or robot_radius > 0):
+            raise ValueError("continuous=True does not support batch_size or robot_radius")
+        if continuous and occupancy_map is not None:
+            raise ValueError("continuous=True does not support occupancy_map")
+        if resolution <= 0 or abs(1.0 / resolution - round(1.0 / resolution)) > 1e-9:
+            raise ValueError("resolution must be 1/n for a whole number n, e.g. 1, 0.5 or 0.25")
+
+        # static obstacle raster, memory mapped when read from a file. Inflating
+        # it for robot_radius reads the whole map into memory
+        self.map_grid = None
+        if occupancy_map is not None:
+            if isinstance(occupancy_map, str):
+                occupancy_map = OccupancyGrid.from_npy(occupancy_map)
+            if robot_radius > 0:
+                occupancy_map = occupancy_map.inflate(robot_radius)
+            if map_tile_size:
+                occupancy_map = TiledOccupancyGrid.from_grid(occupancy_map, map_tile_size)
+            self.map_grid = occupancy_map
 
-        # x and y are lists to store x-y co-ordinates of nodes
-        self.x = []
-        self.y = []
+        # sampling domain (xmin, xmax, ymin, ymax) of generate_random_node
+        if bounds is None:
+            bounds = self.map_grid.bounds if self.map_grid is not None else (-5, 15, -5, 15)
+        if bounds[0] >= bounds[1] or bounds[2] >= bounds[3]:
+            raise ValueError("bounds must be (xmin, xmax, ymin, ymax) with xmin < xmax and ymin < ymax")
+        self.bounds = tuple(bounds)
+        self.resolution = resolution
 
-        # parent list stores the node number of a parent for a given index of child node
-        self.parent = []
+        # maximum distance between a new node and its parent
+        self.step_size = float(step_size)
+
+        # number of samples drawn per batch in execute_rrt, and the samples
+        # checked and nodes added by the batches so far
+        self.batch_size = int(batch_size)
+        self.batch_samples = 0
+        self.batch_nodes = 0
+
+        # incremental replanning against the dynamic obstacles
+        self.replan = replan
+
+        # continuous co-ordinates instead of the integer lattice
+        self.continuous = continuous
+        self.goal_tolerance = goal_tolerance
+        coordinate_type = np.float64 if continuous else np.float32
+
+        # tree stores the x-y co-ordinates and the parent node number of every
+        # node, they are read through the x, y and parent properties
+        self.tree = TreeStore(dtype=coordinate_type)
+
+        # spatial index over the nodes, kept current by add_node
+        self.nn_mode = nn_mode
+        self.index = GridIndex(cell_size)
 
         # We add the start node in the tree
         self.add_node(start_point)
@@ -36,6 +170,24 @@ class RRT:
         # this flag is used to keep track if goal is reached or not
         self.goal_status = False
 
+        # node number of the node which reached the goal
+        self.goal_node = None
+
+        # frame and total node count at which the goal was first reached
+        self.solution_frame = None
+        self.solution_nodes = None
+
+        # RRT-Connect grows a second tree from the goal. connection holds the
+        # node numbers (start tree, goal tree) where the two trees met
+        self.planner = planner
+        self.goal_tree = None
+        self.goal_index = None
+        self.connection = None
+        if planner == 'connect':
+            self.goal_tree = TreeStore(dtype=coordinate_type)
+            self.goal_index = GridIndex(cell_size)
+            self.add_tree_node(self.goal_tree, self.goal_index, goal_point, None)
+
         # this list is used to store points comprising a line between two nodes and retrieve them for collision detections
         self.line_points = None
 
@@ -43,21 +195,132 @@ class RRT:
         self.static_obstacles = static_obstacles
         self.dynamic_obstacles = dynamic_obstacles
 
+        # rasterize the static obstacles once so that edges can be checked with
+        # array lookups instead of point_in_polygon calls. Next to a map the
+        # polygons are only rasterized over their own bounding box, which the
+        # workspace may be much larger than
+        self.static_grid = None
+        self.static_bvh = None
+        self.static_grid_covers_polygons = False
+        if continuous:
+            self.static_bvh = ObstacleBVH(static_obstacles)
+        elif static_check == 'grid':
+            grid_bounds = self.bounds
+            if self.map_grid is not None:
+                grid_bounds = polygon_bounds(static_obstacles, resolution, robot_radius)
+                self.static_grid_covers_polygons = True
+            if grid_bounds is not None:
+                self.static_grid = OccupancyGrid.from_polygons(static_obstacles, grid_bounds, resolution)
+                if robot_radius > 0:
+                    self.static_grid = self.static_grid.inflate(robot_radius)
+
+        # cells occupied by the dynamic obstacles, built once per frame
+        self.dynamic_occupancy = DynamicOccupancy(
+            dynamic_obstacles, self.get_dynamic_obstacle_location,
+            self.get_neighbor_pixels, dynamic_horizon)
+
     ################################################################################
     # Name : add_node
     # Function : This function adds a node in the tree
     ################################################################################
     def add_node(self, node):
         x, y = node
-        self.x.append(x)
-        self.y.append(y)
+        node_id, point = self.tree.add_node(x, y)
+        self.index.insert(node_id, point)
 
     ################################################################################
     # Name : add_edge
-    # Function : This function connects the node to a parent
+    # Function : This function connects the newest node to a parent
     ################################################################################
     def add_edge(self, parent):
-        self.parent.append(parent)
+        self.tree.set_parent(len(self.tree) - 1, parent)
+
+    ################################################################################
+    # Name : x, y, parent
+    # Function : arrays of the node co-ordinates and parent node numbers. These
+    #            are views into the tree storage, so reading them does not copy
+    ################################################################################
+    @property
+    def x(self):
+        return self.tree.x
+
+    @property
+    def y(self):
+        return self.tree.y
+
+    @property
+    def parent(self):
+        return self.tree.parent
+
+    ################################################################################
+    # Name : get_path
+    # Function : returns the (x, y) co-ordinates from the start to a node
+    ################################################################################
+    def get_path(self, node_id):
+        return self.tree.get_path_points(node_id)
+
+    ################################################################################
+    # Name : get_goal_path
+    # Function : returns the (x, y) co-ordinates from the start to the goal, or
+    #            None if the goal has not been reached yet
+    ################################################################################
+    def get_goal_path(self):
+        if self.connection is not None:
+            start_node, goal_node = self.connection
+            start_path = self.get_path(start_node)
+            goal_path = self.goal_tree.get_path_points(goal_node)[::-1]
+            # both trees hold a node at the point where they met
+            return np.concatenate((start_path, goal_path[1:]))
+
+        if self.goal_node is None:
+            return None
+        return self.get_path(self.goal_node)
+
+    ################################################################################
+    # Name : node_count
+    # Function : returns the number of alive nodes in all trees
+    ################################################################################
+    def node_count(self):
+        count = int(self.tree.alive.sum())
+        if self.goal_tree is not None:
+            count += len(self.goal_tree)
+        return count
+
+    ################################################################################
+    # Name : record_goal
+    # Function : marks the goal as reached by a node of the start tree
+    ################################################################################
+    def record_goal(self, node_id, frame):
+        self.goal_status = True
+        self.goal_node = node_id
+        if self.solution_frame is None:
+            self.solution_frame = frame
+            self.solution_nodes = self.node_count()
+
+    ################################################################################
+    # Name : save_tree
+    # Function : writes the tree to a .npz or .npy file
+    ################################################################################
+    def save_tree(self, filename):
+        self.tree.save(filename)
+
+    ################################################################################
+    # Name : load_tree
+    # Function : replaces the tree with one written by save_tree and rebuilds
+    #            the spatial index
+    ################################################################################
+    def load_tree(self, filename):
+        self.tree = TreeStore.load(filename)
+        self.index = GridIndex(self.index.cell_size)
+        for node_id in np.flatnonzero(self.tree.alive).tolist():
+            self.index.insert(node_id, (float(self.x[node_id]), float(self.y[node_id])))
+
+        self.goal_node = None
+        for node_id, point in enumerate(zip(self.x.tolist(), self.y.tolist())):
+            if self.tree.alive[node_id] and self.is_goal_reached(point):
+                self.goal_node = node_id
+                break
+        self.goal_status = self.goal_node is not None
 
     ################################################################################
     # Name : distance
@@ -68,12 +331,26 @@ class RRT:
         x2, y2 = p2
         return math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
 
+    ################################################################################
+    # Name : check_map
+    # Function : checks a list of points against the static obstacle map and
+    #            returns True if any of them is occupied. Points outside the map
+    #            are free
+    ################################################################################
+    def check_map(self, points):
+        occupied, _ = self.map_grid.lookup([point[0] for point in points],
+                                           [point[1] for point in points])
+        return bool(occupied.any())
+
     ################################################################################
     # Name : generate_random_node
     # Function : Generates a random point in the co-ordinate system
     ################################################################################
     def generate_random_node(self):
-        return [round(np.random.uniform(-5, 15)), round(np.random.uniform(-5, 15))]
+        xmin, xmax, ymin, ymax = self.bounds
+        if self.continuous:
+            return [np.random.uniform(xmin, xmax), np.random.uniform(ymin, ymax)]
+        return [round(np.random.uniform(xmin, xmax)), round(np.random.uniform(ymin, ymax))]
 
     ################################################################################
     # Name : generate_bias_node
@@ -87,18 +364,33 @@ class RRT:
     ################################################################################
     # Name : nearest_neighbor
     # Function : find the nearest node to a newly generated node
+    #            (in the start tree unless another tree and its index are given)
+    ################################################################################
+    def nearest_neighbor(self, random_node, tree=None, index=None):
+
+        if self.nn_mode == 'linear':
+            return self.nearest_neighbor_linear(random_node, tree)
+
+        node_number, nearest_node = (index or self.index).nearest(random_node)
+        return nearest_node, node_number
+
+    ################################################################################
+    # Name : nearest_neighbor_linear
+    # Function : reference nearest neighbor search which scans every node
     ################################################################################
-    def nearest_neighbor(self, random_node):
+    def nearest_neighbor_linear(self, random_node, tree=None):
 
+        tree = tree or self.tree
         min_dist = float('inf')
         nearest_node = None
-        Nodes = zip(self.x, self.y)
+        Nodes = zip(tree.x.tolist(), tree.y.tolist())
+        alive = tree.alive.tolist()
         count = 0
         node_number = None
 
         for node in Nodes:
             dist = self.distance(node, random_node)
-            if dist < min_dist:
+            if dist < min_dist and alive[count]:
                 min_dist = dist
                 nearest_node = node
                 node_number = count
@@ -106,6 +398,19 @@ class RRT:
 
         return nearest_node, node_number
 
+    ################################################################################
+    # Name : nodes_within_radius
+    # Function : returns the node numbers of all nodes within a radius of a point
+    ################################################################################
+    def nodes_within_radius(self, point, radius):
+
+        if self.nn_mode == 'linear':
+            alive = self.tree.alive.tolist()
+            return [i for i, node in enumerate(zip(self.x.tolist(), self.y.tolist()))
+                    if alive[i] and self.distance(node, point) <= radius]
+
+        return self.index.within_radius(point, radius)
+
     ################################################################################
     # Name : get_neighbor_pixels
     # Function : Returns the surrounding 8 pixels to an input pixel
@@ -143,9 +448,10 @@ class RRT:
     ################################################################################
     # Name : get_line_points
     # Function : Returns a list of points which make up a line from point A 
-    #            to point B (including  and B)
+    #            to point B (including  and B). With max_points only the first
+    #            max_points points of the line are traced
     ################################################################################
-    def get_line_points(self, pointA, pointB):
+    def get_line_points(self, pointA, pointB, max_points=None):
         x1, y1 = pointA
         x2, y2 = pointB
         points = []
@@ -160,6 +466,8 @@ class RRT:
             err = dx / 2.0
             while x != x2:
                 points.append((x, y))
+                if len(points) == max_points:
+                    return points
                 err -= dy
                 if err < 0:
                     y += sy
@@ -169,6 +477,8 @@ class RRT:
             err = dy / 2.0
             while y != y2:
                 points.append((x, y))
+                if len(points) == max_points:
+                    return points
                 err -= dx
                 if err < 0:
                     x += sx
@@ -183,7 +493,9 @@ class RRT:
     ################################################################################
     def is_goal_reached(self, node_point):
         reached = False
-        if (node_point[0] == self.goal[0] and node_point[1] == self.goal[1]):
+        if self.continuous:
+            reached = self.distance(node_point, self.goal) <= self.goal_tolerance
+        elif (node_point[0] == self.goal[0] and node_point[1] == self.goal[1]):
             reached = True
         return reached
 
@@ -200,47 +512,95 @@ class RRT:
         y = [i[1] + frame*vy for i in point]
         return x, y
 
+    ################################################################################
+    # Name : check_static_grid
+    # Function : checks a list of points against the static occupancy grid and
+    #            returns True if any of them collides. Points outside the grid
+    #            fall back to point_in_polygon, unless the grid covers every
+    #            polygon
+    ################################################################################
+    def check_static_grid(self, points):
+
+        x = [point[0] for point in points]
+        y = [point[1] for point in points]
+        occupied, inside = self.static_grid.lookup(x, y)
+
+        if occupied.any():
+            return True
+
+        if not inside.all() and not self.static_grid_covers_polygons:
+            for i in np.flatnonzero(~inside):
+                for polygon in self.static_obstacles:
+                    if self.point_in_polygon(points[i], polygon):
+                        return True
+
+        return False
+
     ################################################################################
     # Name : check_node_viability
     # Function : checks whether the new node and edge collide with obstacles
     ################################################################################
     def check_node_viability(self, node, parent, frame):
 
+        if self.continuous:
+            return not (self.static_bvh.segment_collides(parent, node) or
+                        self.dynamic_occupancy.segment_collides(parent, node, frame))
+
         isViable = True
 
         # get the list of points on the edge
         points = self.get_line_points(parent, node)
 
         # check if edge points collide with static obstacles
-        for polygon in self.static_obstacles:
+        if self.static_grid is not None:
+            isViable = not self.check_static_grid(points)
 
-            if isViable == False:
-                break
+        else:
+            for polygon in self.static_obstacles:
 
-            for point in points:
-                isInsidePolygon = self.point_in_polygon(point, polygon)
-                if isInsidePolygon == True:
-                    isViable = False
+                if isViable == False:
                     break
 
+                for point in points:
+                    isInsidePolygon = self.point_in_polygon(point, polygon)
+                    if isInsidePolygon == True:
+                        isViable = False
+                        break
+
         
-        # check if edge points collide with static obstacles
+        # check if edge points collide with the static obstacle map
+        if isViable == True and self.map_grid is not None:
+            isViable = not self.check_map(points)
+
+        # check if edge points collide with dynamic obstacles
         if isViable == True:
+            isViable = not self.dynamic_occupancy.collides(points, frame)
 
-            for obstacle in self.dynamic_obstacles:
-                obstacle_point = self.get_dynamic_obstacle_location(
-                    obstacle, frame)
+        return isViable
 
-                obstacle_points = self.get_neighbor_pixels(
-                    (int(obstacle_point[0][0]), int(obstacle_point[1][0])))
-                for obstacle_point in obstacle_points:
-                    for point in points:
-                        if (point[0] == obstacle_point[0] and point[1] == obstacle_point[1]):
-                            isViable = False
-                            break
 
-        return isViable
+    ################################################################################
+    # Name : steer
+    # Function : returns the new node on the way from a neighbor towards a
+    #            random node, at most step_size away from the neighbor. On the
+    #            lattice this is the furthest line point within step_size, in
+    #            continuous mode the point at step_size along the line. Line
+    #            point i is at least i away from the neighbor, so the line is
+    #            only traced up to step_size points
+    ################################################################################
+    def steer(self, neighbor, random_node):
+
+        if not self.continuous:
+            self.line_points = self.get_line_points(neighbor, random_node,
+                                                    int(self.step_size) + 1)
+            return self.get_thresholded_node(neighbor)
 
+        dist = self.distance(neighbor, random_node)
+        if dist <= self.step_size:
+            return (float(random_node[0]), float(random_node[1]))
+        ratio = self.step_size / dist
+        return (neighbor[0] + ratio * (random_node[0] - neighbor[0]),
+                neighbor[1] + ratio * (random_node[1] - neighbor[1]))
 
     ################################################################################
     # Name : get_thresholded_node
@@ -252,40 +612,455 @@ class RRT:
 
         thresholded_node = None
         for point in reversed(self.line_points):
-            if (self.distance(point, neighbor) <= 4.0):
+            if (self.distance(point, neighbor) <= self.step_size):
                 thresholded_node = point
                 break
 
         return thresholded_node
 
     ################################################################################
-    # Name : execute_rrt
-    # Function : run one step of the RRT algorithm for the particular frame
+    # Name : generate_random_nodes
+    # Function : Generates an array of count random points in the co-ordinate
+    #            system
     ################################################################################
-    def execute_rrt(self, frame):
+    def generate_random_nodes(self, count):
+        xmin, xmax, ymin, ymax = self.bounds
+        x = np.rint(np.random.uniform(xmin, xmax, count)).astype(np.int64)
+        y = np.rint(np.random.uniform(ymin, ymax, count)).astype(np.int64)
+        return np.stack((x, y), axis=1)
 
-        if self.goal_status == False:
+    ################################################################################
+    # Name : nearest_neighbors
+    # Function : finds the nearest node for every row of an array of points and
+    #            returns the node co-ordinates and node numbers as arrays. When
+    #            the distance matrix has at most nn_matrix_size entries it is
+    #            computed in one go, otherwise the index is queried per point.
+    #            argmin picks the lowest node number on ties, like the index
+    ################################################################################
+    def nearest_neighbors(self, nodes):
+
+        if self.nn_mode == 'linear' or len(nodes) * len(self.tree) <= self.nn_matrix_size:
+            x, y = self.x, self.y
+            dist = np.sqrt((x - nodes[:, 0:1]) ** 2 + (y - nodes[:, 1:2]) ** 2)
+            dist[:, ~self.tree.alive] = np.inf
+            node_numbers = np.argmin(dist, axis=1)
+            return np.stack((x[node_numbers], y[node_numbers]), axis=1).astype(np.float64), node_numbers
 
-            isViable = False
-            isFirstPass = True
-            while (isViable == False):
+        node_numbers = []
+        nearest_nodes = []
+        for node in nodes.tolist():
+            node_number, nearest_node = self.index.nearest(node)
+            node_numbers.append(node_number)
+            nearest_nodes.append(nearest_node)
+        return np.array(nearest_nodes), np.array(node_numbers)
+
+    ################################################################################
+    # Name : steer_nodes
+    # Function : steer for arrays of neighbors and random nodes on the lattice.
+    #            Line point k of get_line_points is k steps along the major axis
+    #            and ceil((2 k minor - major) / (2 major)) steps along the minor
+    #            one, so the first step_size + 1 points of every line are
+    #            computed at once and the furthest one within step_size is
+    #            picked. Returns the nodes as a list of (x, y) tuples, the same
+    #            as steer returns for every row
+    ################################################################################
+    def steer_nodes(self, neighbors, random_nodes):
 
-                if (frame % 4 == 0 and isFirstPass == True):
+        delta = random_nodes - neighbors
+        sign = np.where(delta < 0, -1, 1)
+        delta = np.abs(delta).astype(np.int64)
+        x_major = delta[:, 0] > delta[:, 1]
+        major = np.where(x_major, delta[:, 0], delta[:, 1])[:, np.newaxis]
+        minor = np.where(x_major, delta[:, 1], delta[:, 0])[:, np.newaxis]
 
-                    random_node = self.generate_bias_node()
-                    isFirstPass = False
-                else:
-                    random_node = self.generate_random_node()
+        # steps along both axes of the first step_size + 1 line points
+        k = np.arange(int(self.step_size) + 1)[np.newaxis, :]
+        m = np.maximum(-((major - 2 * k * minor) // np.maximum(2 * major, 1)), 0)
+
+        # the furthest of them which is on the line and within step_size
+        reachable = (k <= major) & (np.sqrt(k ** 2 + m ** 2) <= self.step_size)
+        last = reachable.shape[1] - 1 - np.argmax(reachable[:, ::-1], axis=1)
+        rows = np.arange(len(neighbors))
+        k, m = k[0, last], m[rows, last]
+
+        x = neighbors[:, 0] + sign[:, 0] * np.where(x_major, k, m)
+        y = neighbors[:, 1] + sign[:, 1] * np.where(x_major, m, k)
+        return list(zip(x.tolist(), y.tolist()))
+
+    ################################################################################
+    # Name : check_nodes_viability
+    # Function : check_node_viability for lists of nodes and parents. The edge
+    #            points of all of them are looked up in the static grid and the
+    #            map at once. Returns a bool array which is True for every
+    #            viable node
+    ################################################################################
+    def check_nodes_viability(self, nodes, parents, frame):
 
+        if self.static_grid is None and self.static_obstacles:
+            return np.array([self.check_node_viability(node, parent, frame)
+                             for node, parent in zip(nodes, parents)], dtype=bool)
+
+        lines = [self.get_line_points(parent, node) for node, parent in zip(nodes, parents)]
+        x = [point[0] for line in lines for point in line]
+        y = [point[1] for line in lines for point in line]
+        starts = np.cumsum([0] + [len(line) for line in lines[:-1]])
+
+        # static obstacles, points outside the grid fall back to point_in_polygon
+        isViable = np.ones(len(lines), dtype=bool)
+        if self.static_grid is not None:
+            occupied, inside = self.static_grid.lookup(x, y)
+            isViable = ~np.logical_or.reduceat(occupied, starts)
+            if not self.static_grid_covers_polygons:
+                outside = np.logical_or.reduceat(~inside, starts)
+                for i in np.flatnonzero(isViable & outside):
+                    isViable[i] = not self.check_static_grid(lines[i])
+
+        # static obstacle map
+        if self.map_grid is not None:
+            occupied, _ = self.map_grid.lookup(x, y)
+            isViable &= ~np.logical_or.reduceat(occupied, starts)
+
+        # dynamic obstacles
+        for i in np.flatnonzero(isViable):
+            isViable[i] = not self.dynamic_occupancy.collides(lines[i], frame)
+
+        return isViable
+
+    ################################################################################
+    # Name : sample_chunk
+    # Function : draws count samples, finds their nearest nodes and checks the
+    #            steered nodes together. Returns the first viable
+    #            (node, neighbor_id, sample number) or (None, None, None)
+    ################################################################################
+    def sample_chunk(self, count, frame):
+
+        samples = self.generate_random_nodes(count)
+        neighbors, neighbor_ids = self.nearest_neighbors(samples)
+        nodes = self.steer_nodes(neighbors, samples)
+        neighbors = neighbors.tolist()
+
+        isViable = self.check_nodes_viability(nodes, neighbors, frame)
+        if not isViable.any():
+            return None, None, None
+
+        i = int(np.argmax(isViable))
+        return nodes[i], int(neighbor_ids[i]), i
+
+    ################################################################################
+    # Name : sample_batch
+    # Function : draws up to batch_size samples in chunks and returns the first
+    #            viable (node, neighbor_id), or (None, None), and the number of
+    #            samples checked. The first chunk holds as many samples as a
+    #            node has needed on average so far and every later chunk twice
+    #            as many, so the search stops soon after the first viable
+    #            sample. When a node has needed less than two samples on
+    #            average, the samples (and the goal when biased) are checked
+    #            one at a time on the serial path, which is cheaper for a
+    #            single sample
+    ################################################################################
+    def sample_batch(self, frame, bias):
+
+        chunk_size = max(1, self.batch_samples // max(self.batch_nodes, 1))
+        checked = 0
+        node = None
+
+        while node is None and checked < self.batch_size:
+            count = min(chunk_size, self.batch_size - checked)
+
+            if bias or count < self.min_chunk:
+                random_node = self.generate_bias_node() if bias else self.generate_random_node()
                 neighbor_xy, neighbor_id = self.nearest_neighbor(random_node)
-                self.line_points = self.get_line_points(
-                    neighbor_xy, random_node)
-                node = self.get_thresholded_node(neighbor_xy)
-                isViable = self.check_node_viability(node, neighbor_xy, frame)
-
-            self.add_node(node)
-            self.add_edge(neighbor_id)
-            self.goal_status = self.is_goal_reached(node)
+                node = self.steer(neighbor_xy, random_node)
+                if not self.check_node_viability(node, neighbor_xy, frame):
+                    node = None
+                checked += 1
+                bias = False
+            else:
+                node, neighbor_id, i = self.sample_chunk(count, frame)
+                checked += count if node is None else i + 1
+                chunk_size *= 2
+
+        self.batch_samples += checked
+        if node is None:
+            return None, None, checked
+        self.batch_nodes += 1
+        return node, neighbor_id, checked
+
+    ################################################################################
+    # Name : repair_tree
+    # Function : finds the edges crossed by the dynamic obstacles in a frame and
+    #            rewires each of them to another nearby node, or prunes the
+    #            subtree below it when no collision free parent is found. Only
+    #            nodes within step_size of an occupied cell are looked at, since
+    #            a longer edge cannot exist. In continuous mode an edge collides
+    #            with the unit square around a cell, so the radius grows by half
+    #            the diagonal of the square. Returns the number of rewired and
+    #            pruned nodes
+    ################################################################################
+    def repair_tree(self, frame):
+
+        radius = self.step_size
+        if self.continuous:
+            radius += math.sqrt(0.5)
+
+        candidates = set()
+        for cell in self.dynamic_occupancy.cells(frame):
+            candidates.update(self.nodes_within_radius(cell, radius))
+
+        rewired = 0
+        pruned = 0
+        for node_id in sorted(candidates):
+
+            # the root has no edge and pruned nodes have no edge to repair
+            parent_id = int(self.parent[node_id])
+            if parent_id == node_id or not self.tree.alive[node_id]:
+                continue
+
+            node = (float(self.x[node_id]), float(self.y[node_id]))
+            parent = (float(self.x[parent_id]), float(self.y[parent_id]))
+            if self.continuous:
+                collides = self.dynamic_occupancy.segment_collides(parent, node, frame)
+            else:
+                collides = self.dynamic_occupancy.collides(self.get_line_points(parent, node), frame)
+            if not collides:
+                continue
+
+            if self.rewire_node(node_id, frame):
+                rewired += 1
+            else:
+                pruned += self.prune_subtree(node_id)
+
+        return {'rewired': rewired, 'pruned': pruned}
+
+    ################################################################################
+    # Name : rewire_node
+    # Function : connects a node to the closest node within step_size that is
+    #            not one of its descendants and has a collision free edge to it.
+    #            Returns False if there is no such node
+    ################################################################################
+    def rewire_node(self, node_id, frame):
+
+        node = (float(self.x[node_id]), float(self.y[node_id]))
+        subtree = set(self.tree.get_subtree(node_id).tolist())
+
+        neighbors = []
+        for neighbor_id in self.nodes_within_radius(node, self.step_size):
+            if neighbor_id not in subtree:
+                neighbor = (float(self.x[neighbor_id]), float(self.y[neighbor_id]))
+                neighbors.append((self.distance(neighbor, node), neighbor_id, neighbor))
+
+        for _, neighbor_id, neighbor in sorted(neighbors):
+            if self.check_node_viability(node, neighbor, frame):
+                self.tree.set_parent(node_id, neighbor_id)
+                return True
+
+        return False
+
+    ################################################################################
+    # Name : prune_subtree
+    # Function : removes a node and its descendants from the tree and the
+    #            spatial index and returns the number of nodes removed
+    ################################################################################
+    def prune_subtree(self, node_id):
+
+        subtree = self.tree.get_subtree(node_id)
+        subtree = subtree[self.tree.alive[subtree]]
+
+        for i in subtree.tolist():
+            self.index.remove(i, (float(self.x[i]), float(self.y[i])))
+        self.tree.remove(subtree)
+
+        if self.goal_node is not None and not self.tree.alive[self.goal_node]:
+            self.goal_node = None
+            self.goal_status = False
+
+        return len(subtree)
+
+    ################################################################################
+    # Name : add_tree_node
+    # Function : adds a node to a tree and its spatial index and connects it to
+    #            a parent (None makes the node the root of the tree)
+    ################################################################################
+    def add_tree_node(self, tree, index, node, parent):
+        x, y = node
+        node_id, point = tree.add_node(x, y)
+        index.insert(node_id, point)
+        tree.set_parent(node_id, node_id if parent is None else parent)
+        return node_id
+
+    ################################################################################
+    # Name : extend_tree
+    # Function : grows a tree by one step from its nearest node towards a target
+    #            point. Returns ('reached' | 'advanced' | 'trapped', node number).
+    #            Edges are checked in the direction the path travels them: away
+    #            from the root in the start tree, towards it in the goal tree,
+    #            since the rasterized line depends on the direction
+    ################################################################################
+    def extend_tree(self, tree, index, target, frame):
+
+        neighbor_xy, neighbor_id = self.nearest_neighbor(target, tree, index)
+        if self.distance(neighbor_xy, target) == 0:
+            return 'reached', neighbor_id
+
+        node = self.steer(neighbor_xy, target)
+        if tree is self.goal_tree:
+            isViable = self.check_node_viability(neighbor_xy, node, frame)
+        else:
+            isViable = self.check_node_viability(node, neighbor_xy, frame)
+        if not isViable:
+            return 'trapped', None
+
+        node_id = self.add_tree_node(tree, index, node, neighbor_id)
+        if self.distance(node, target) == 0:
+            return 'reached', node_id
+        return 'advanced', node_id
+
+    ################################################################################
+    # Name : connect_tree
+    # Function : extends a tree towards a target point until it reaches it or
+    #            gets trapped
+    ################################################################################
+    def connect_tree(self, tree, index, target, frame):
+        status = 'advanced'
+        while status == 'advanced':
+            status, node_id = self.extend_tree(tree, index, target, frame)
+        return status, node_id
+
+    ################################################################################
+    # Name : expand_connect
+    # Function : one attempt of RRT-Connect. The start and goal trees take turns
+    #            per frame: the active tree is extended towards a random node
+    #            and, if the step succeeds, the other tree greedily connects to
+    #            the new node. The goal is reached when the trees meet. Returns
+    #            True if the active tree was extended
+    ################################################################################
+    def expand_connect(self, frame):
+
+        trees = [(self.tree, self.index), (self.goal_tree, self.goal_index)]
+        if frame % 2 == 0:
+            trees.reverse()
+        (tree_a, index_a), (tree_b, index_b) = trees
+
+        random_node = self.generate_random_node()
+        status, node_a = self.extend_tree(tree_a, index_a, random_node, frame)
+        if status == 'trapped':
+            return False
+
+        target = (float(tree_a.x[node_a]), float(tree_a.y[node_a]))
+        status, node_b = self.connect_tree(tree_b, index_b, target, frame)
+
+        if status == 'reached':
+            start_node, goal_node = (node_a, node_b) if tree_a is self.tree else (node_b, node_a)
+            self.connection = (start_node, goal_node)
+            self.record_goal(start_node, frame)
+        return True
+
+    ################################################################################
+    # Name : expand_batch
+    # Function : one attempt with a batch of samples, adds the first viable node.
+    #            Returns whether a node was added and the number of samples
+    #            checked
+    ################################################################################
+    def expand_batch(self, frame, bias):
+
+        node, neighbor_id, samples = self.sample_batch(frame, bias)
+        if node is None:
+            return False, samples
+
+        self.add_node(node)
+        self.add_edge(neighbor_id)
+        if self.is_goal_reached(node):
+            self.record_goal(len(self.tree) - 1, frame)
+        return True, samples
+
+    ################################################################################
+    # Name : expand_once
+    # Function : one attempt with a single sample (the goal if bias is True).
+    #            Returns True if a node was added
+    ################################################################################
+    def expand_once(self, frame, bias):
+
+        if bias:
+            random_node = self.generate_bias_node()
+        else:
+            random_node = self.generate_random_node()
+
+        neighbor_xy, neighbor_id = self.nearest_neighbor(random_node)
+        node = self.steer(neighbor_xy, random_node)
+        isViable = self.check_node_viability(node, neighbor_xy, frame)
+        if isViable == False:
+            return False
+
+        self.add_node(node)
+        self.add_edge(neighbor_id)
+        if self.is_goal_reached(node):
+            self.record_goal(len(self.tree) - 1, frame)
+        return True
+
+    ################################################################################
+    # Name : execute_rrt
+    # Function : run one step of the RRT algorithm for the particular frame.
+    #            Without a budget, samples are drawn until one node is added.
+    #            With budget_ms, nodes are added until the time budget runs out
+    #            (or max_expansions nodes were added) and the call returns even
+    #            if no node was added. Returns a dict with the number of samples
+    #            and nodes added, whether the deadline was hit, whether the goal
+    #            is reached and the node closest to the goal
+    ################################################################################
+    def execute_rrt(self, frame, budget_ms=None, max_expansions=None):
+
+        start_time = time.perf_counter()
+        deadline = None if budget_ms is None else start_time + budget_ms / 1000.0
+        if max_expansions is None:
+            max_expansions = 1 if budget_ms is None else float('inf')
+
+        # drop the dynamic obstacle cells of past frames
+        self.dynamic_occupancy.advance(frame)
+
+        if self.replan:
+            self.repair_tree(frame)
+
+        node_count = self.node_count()
+        expansions = 0
+        samples = 0
+        deadline_hit = False
+        isFirstPass = True
+
+        while self.goal_status == False and expansions < max_expansions:
+
+            if deadline is not None and time.perf_counter() >= deadline:
+                deadline_hit = True
+                break
+
+            if self.planner == 'connect':
+                expanded = self.expand_connect(frame)
+                samples += 1
+            elif self.batch_size > 1:
+                expanded, checked = self.expand_batch(frame, frame % 4 == 0 and isFirstPass)
+                samples += checked
+            else:
+                expanded = self.expand_once(frame, frame % 4 == 0 and isFirstPass)
+                samples += 1
+
+            isFirstPass = False
+            if expanded:
+                expansions += 1
+
+        if self.stats is not None:
+            self.stats.end_frame(frame, self.node_count(),
+                                 samples=samples,
+                                 rejected=samples - expansions,
+                                 nodes_added=self.node_count() - node_count,
+                                 frame_ms=1000.0 * (time.perf_counter() - start_time))
+
+        best_node, best_point = self.index.nearest(self.goal)
+        return {'samples': samples,
+                'nodes_added': self.node_count() - node_count,
+                'deadline_hit': deadline_hit,
+                'goal_reached': self.goal_status,
+                'best_node': best_node,
+                'best_distance': self.distance(best_point, self.goal),
+                'elapsed_ms': 1000.0 * (time.perf_counter() - start_time)}
 
 
 if __name__ == "__main__":
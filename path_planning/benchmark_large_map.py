@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+################################################################################
+# File - benchmark_large_map.py
+# Function - Scaling benchmark for static obstacle maps read from large .npy
+#            rasters. For every map size a synthetic raster of random discs is
+#            written to disk in row chunks (so the map never has to fit in
+#            RAM), then load_env, edge lookups and execute_rrt are timed with
+#            the map memory mapped, both directly and through the tiled lookup.
+#            The growth of the resident set size of the process is reported
+#            next to the raster size to show how much of the map is read.
+#
+# Usage - python3 benchmark_large_map.py --sizes 1000 3000 10000
+################################################################################
+
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+from RRT import RRT
+
+# rows of the raster written per chunk
+CHUNK_ROWS = 256
+
+
+################################################################################
+# Name : write_map
+# Function : writes a size x size uint8 raster with random discs of radius
+#            5 to 25 cells (about one per 2500 cells) and a free corner around
+#            the start point, chunk by chunk through np.lib.format.open_memmap
+################################################################################
+def write_map(filename, size, seed=0):
+
+    rng = np.random.default_rng(seed)
+    count = max(1, size * size // 2500)
+    cx = rng.uniform(0, size, count)
+    cy = rng.uniform(0, size, count)
+    r = rng.uniform(5, 25, count)
+
+    data = np.lib.format.open_memmap(filename, mode='w+', dtype=np.uint8, shape=(size, size))
+    cols = np.arange(size)
+    for row0 in range(0, size, CHUNK_ROWS):
+        rows = np.arange(row0, min(row0 + CHUNK_ROWS, size))
+        chunk = np.zeros((len(rows), size), dtype=np.uint8)
+        near = (cy + r >= rows[0]) & (cy - r <= rows[-1])
+        for x, y, radius in zip(cx[near], cy[near], r[near]):
+            col0, col1 = max(int(x - radius), 0), min(int(x + radius) + 1, size)
+            dist = (cols[None, col0:col1] - x) ** 2 + (rows[:, None] - y) ** 2
+            chunk[:, col0:col1] |= (dist <= radius * radius).astype(np.uint8)
+        data[rows[0]:rows[-1] + 1] = chunk
+    data[:50, :50] = 0
+    data.flush()
+    del data
+
+
+################################################################################
+# Name : rss_mib
+# Function : returns the peak resident set size of the process in MiB
+################################################################################
+def rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+################################################################################
+# Name : bench_map
+# Function : times load_env, execute_rrt and check_node_viability on one map
+#            and records the growth of the peak resident set size after
+#            planning and after the edge checks
+################################################################################
+def bench_map(filename, size, tile_size, frames, edges):
+
+    np.random.seed(0)
+    rss_before = rss_mib()
+
+    start = time.perf_counter()
+    step_size = size / 50
+    rrt_algo = RRT()
+    rrt_algo.load_env((10, 10), (size - 10, size - 10), [], [], occupancy_map=filename,
+                      map_tile_size=tile_size, step_size=step_size, cell_size=step_size)
+    load_ms = 1000 * (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for frame in range(1, frames + 1):
+        rrt_algo.execute_rrt(frame, max_expansions=1)
+    frame_ms = 1000 * (time.perf_counter() - start) / frames
+    plan_rss = rss_mib() - rss_before
+
+    # random edges all over the map, which pages in most of the raster
+    rng = np.random.default_rng(1)
+    starts = rng.integers(0, size, (edges, 2))
+    offsets = rng.integers(-int(step_size), int(step_size) + 1, (edges, 2))
+    ends = np.clip(starts + offsets, 0, size - 1)
+    start = time.perf_counter()
+    for p, q in zip(starts.tolist(), ends.tolist()):
+        rrt_algo.check_node_viability(tuple(q), tuple(p), 1)
+    check_us = 1e6 * (time.perf_counter() - start) / edges
+
+    return {'load_ms': load_ms, 'frame_ms': frame_ms, 'nodes': len(rrt_algo.tree),
+            'plan_rss_mib': plan_rss, 'check_us': check_us, 'rss_mib': rss_mib() - rss_before}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark planning on large memory mapped maps')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 3000, 10000],
+                        help='map sizes in cells per side')
+    parser.add_argument('--tile-size', type=int, default=512, help='tile size of the tiled lookup')
+    parser.add_argument('--frames', type=int, default=500, help='execute_rrt frames per map')
+    parser.add_argument('--edges', type=int, default=2000, help='edges checked per map')
+    parser.add_argument('--dir', help='directory for the rasters (default: a temporary one)')
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp()
+    for size in args.sizes:
+        filename = os.path.join(directory, 'map_%d.npy' % size)
+        if not os.path.exists(filename):
+            start = time.perf_counter()
+            write_map(filename, size)
+            print('wrote %s (%.1f MiB) in %.1f s'
+                  % (filename, os.path.getsize(filename) / 2 ** 20, time.perf_counter() - start))
+
+        for name, tile_size in (('memmap', None), ('tiled', args.tile_size)):
+            result = bench_map(filename, size, tile_size, args.frames, args.edges)
+            print('%6d x %-6d %-7s load %6.2f ms  execute_rrt %7.3f ms/frame  nodes %5d'
+                  '  rss +%6.1f MiB  check %6.1f us/edge  rss +%6.1f MiB'
+                  % (size, size, name, result['load_ms'], result['frame_ms'], result['nodes'],
+                     result['plan_rss_mib'], result['check_us'], result['rss_mib']))
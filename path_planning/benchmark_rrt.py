@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+
+################################################################################
+# File - benchmark_rrt.py
+# Function - Seeded microbenchmarks for the hot paths of the RRT planner
+#            (nearest_neighbor, get_line_points, point_in_polygon,
+#            check_node_viability and full execute_rrt runs) on synthetic maps
+#            of increasing size, obstacle count and tree size. Every case records
+#            ops/sec, p50/p99 latency per call and peak traced memory. Results
+#            can be saved as a baseline JSON and later runs compared against it.
+#            baseline_rrt.json is the committed baseline, which --compare
+#            reads by default. Before benchmarking, seeded runs check that the
+#            planner stays correct. Exits with status 1 on a failed check or a
+#            regression.
+#
+# Usage - python3 benchmark_rrt.py --compare
+#         python3 benchmark_rrt.py --save-baseline
+#         python3 benchmark_rrt.py --check-only
+################################################################################
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from RRT import RRT
+
+# a case is a regression when its p50 latency grows by more than this factor
+REGRESSION_FACTOR = 1.2
+
+# baseline JSON of --compare and --save-baseline without a file name
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline_rrt.json')
+
+# seeds of the correctness checks
+CHECK_SEEDS = 200
+
+
+################################################################################
+# Name : make_obstacles
+# Function : returns count random convex-ish polygons (jittered regular
+#            polygons) inside the workspace, away from the start point
+################################################################################
+def make_obstacles(count, rng, bounds=(-5, 15, -5, 15), vertices=6, radius=1.0):
+
+    xmin, xmax, ymin, ymax = bounds
+    obstacles = []
+    while len(obstacles) < count:
+        cx = rng.uniform(xmin + radius, xmax - radius)
+        cy = rng.uniform(ymin + radius, ymax - radius)
+        if math.hypot(cx + 2, cy + 2) < 2 * radius:
+            continue
+        polygon = []
+        for i in range(vertices):
+            angle = 2 * math.pi * i / vertices
+            r = radius * rng.uniform(0.6, 1.0)
+            polygon.append((cx + r * math.cos(angle), cy + r * math.sin(angle)))
+        obstacles.append(polygon)
+    return obstacles
+
+
+################################################################################
+# Name : enclose_point
+# Function : returns four walls of the given thickness around a square of the
+#            given half width centred on a point. A goal placed there can only
+#            be reached by nodes inside the walls, so a tree grown from outside
+#            never reaches it
+################################################################################
+def enclose_point(point, half_width=2.0, thickness=1.0):
+
+    x, y = point
+    inner, outer = half_width, half_width + thickness
+    return [[(x - outer, y - outer), (x + outer, y - outer), (x + outer, y - inner), (x - outer, y - inner)],
+            [(x - outer, y + inner), (x + outer, y + inner), (x + outer, y + outer), (x - outer, y + outer)],
+            [(x - outer, y - inner), (x - inner, y - inner), (x - inner, y + inner), (x - outer, y + inner)],
+            [(x + inner, y - inner), (x + outer, y - inner), (x + outer, y + inner), (x + inner, y + inner)]]
+
+
+################################################################################
+# Name : make_planner
+# Function : returns an RRT with the environment loaded and tree_size random
+#            nodes added directly to the tree
+################################################################################
+def make_planner(obstacles, tree_size, rng, **options):
+
+    rrt_algo = RRT()
+    rrt_algo.load_env((-2, -2), (8, 6), [], obstacles, **options)
+    for i in range(1, tree_size):
+        rrt_algo.add_node((rng.uniform(-5, 15), rng.uniform(-5, 15)))
+        rrt_algo.add_edge(rng.randrange(i))
+    return rrt_algo
+
+
+################################################################################
+# Name : measure
+# Function : calls fn(i) for i in range(calls) and returns ops/sec, p50 and
+#            p99 latency in ms and the peak traced memory in KiB (measured in
+#            a second, shorter pass since tracing slows the calls down)
+################################################################################
+def measure(fn, calls):
+
+    latencies = np.empty(calls)
+    total_start = time.perf_counter()
+    for i in range(calls):
+        start = time.perf_counter()
+        fn(i)
+        latencies[i] = time.perf_counter() - start
+    total = time.perf_counter() - total_start
+
+    tracemalloc.start()
+    for i in range(min(calls, 100)):
+        fn(i)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'calls': calls,
+            'ops_per_sec': calls / total,
+            'p50_ms': 1000 * float(np.percentile(latencies, 50)),
+            'p99_ms': 1000 * float(np.percentile(latencies, 99)),
+            'peak_kib': peak / 1024}
+
+
+################################################################################
+# Name : bench_nearest_neighbor
+################################################################################
+def bench_nearest_neighbor(results, quick, case_filter):
+
+    for tree_size in ([1000, 10000] if quick else [1000, 10000, 50000]):
+        for nn_mode in ('grid', 'linear'):
+            name = 'nearest_neighbor/%s/nodes=%d' % (nn_mode, tree_size)
+            if case_filter not in name:
+                continue
+            rng = random.Random(0)
+            rrt_algo = make_planner([], tree_size, rng, nn_mode=nn_mode)
+            queries = [(rng.uniform(-5, 15), rng.uniform(-5, 15)) for _ in range(1000)]
+            calls = 1000 if nn_mode == 'grid' else max(20, 200000 // tree_size)
+            results[name] = measure(
+                lambda i: rrt_algo.nearest_neighbor(queries[i % len(queries)]), calls)
+
+
+################################################################################
+# Name : bench_get_line_points
+################################################################################
+def bench_get_line_points(results, quick, case_filter):
+
+    rrt_algo = RRT()
+    rng = random.Random(0)
+    for length in (4, 20, 100):
+        name = 'get_line_points/length=%d' % length
+        pairs = []
+        for _ in range(1000):
+            x, y = rng.randrange(-50, 50), rng.randrange(-50, 50)
+            angle = rng.uniform(0, 2 * math.pi)
+            pairs.append(((x, y), (x + round(length * math.cos(angle)), y + round(length * math.sin(angle)))))
+        if case_filter in name:
+            results[name] = measure(
+                lambda i: rrt_algo.get_line_points(*pairs[i % len(pairs)]), 2000)
+
+
+################################################################################
+# Name : bench_point_in_polygon
+################################################################################
+def bench_point_in_polygon(results, quick, case_filter):
+
+    rrt_algo = RRT()
+    rng = random.Random(0)
+    for vertices in (4, 16, 64):
+        name = 'point_in_polygon/vertices=%d' % vertices
+        polygon = make_obstacles(1, rng, vertices=vertices, radius=5.0)[0]
+        points = [(rng.uniform(-5, 15), rng.uniform(-5, 15)) for _ in range(1000)]
+        if case_filter in name:
+            results[name] = measure(
+                lambda i: rrt_algo.point_in_polygon(points[i % len(points)], polygon), 5000)
+
+
+################################################################################
+# Name : bench_check_node_viability
+################################################################################
+def bench_check_node_viability(results, quick, case_filter):
+
+    for count in ([10, 100] if quick else [10, 100, 1000]):
+        for mode, options in (('grid', {'static_check': 'grid'}),
+                              ('polygon', {'static_check': 'polygon'}),
+                              ('bvh', {'continuous': True})):
+            name = 'check_node_viability/%s/obstacles=%d' % (mode, count)
+            if case_filter not in name:
+                continue
+            rng = random.Random(0)
+            obstacles = make_obstacles(count, rng, radius=0.8)
+            rrt_algo = make_planner(obstacles, 1, rng, **options)
+            edges = []
+            for _ in range(1000):
+                x, y = rng.randrange(-5, 16), rng.randrange(-5, 16)
+                edges.append(((x + rng.randrange(-3, 4), y + rng.randrange(-3, 4)), (x, y)))
+            calls = max(50, 20000 // count) if mode == 'polygon' else 1000
+            results[name] = measure(
+                lambda i: rrt_algo.check_node_viability(*edges[i % len(edges)], 1), calls)
+
+
+################################################################################
+# Name : bench_execute_rrt
+# Function : full execute_rrt runs, one call per frame. The goal is enclosed
+#            by walls, so the trees never connect and every frame adds a node
+################################################################################
+def bench_execute_rrt(results, quick, case_filter):
+
+    goal = (12, 12)
+    for count in ([10, 50, 300] if quick else [10, 50, 150, 300]):
+        for mode, options in (('serial', {}), ('batch32', {'batch_size': 32}),
+                              ('connect', {'planner': 'connect'})):
+            name = 'execute_rrt/%s/obstacles=%d' % (mode, count)
+            if case_filter not in name:
+                continue
+            rng = random.Random(0)
+            np.random.seed(0)
+            obstacles = make_obstacles(count, rng, radius=0.8) + enclose_point(goal)
+            rrt_algo = RRT()
+            rrt_algo.load_env((-2, -2), goal, [], obstacles, **options)
+            results[name] = measure(
+                lambda i: rrt_algo.execute_rrt(i + 1), 300 if quick else 1000)
+
+
+################################################################################
+# Name : bench_map_size
+# Function : full execute_rrt runs on square maps of increasing side length
+#            with the same obstacle density (about 0.06 obstacles per unit
+#            area, 25 on the default 20 x 20 map) and the goal enclosed by
+#            walls near the far corner
+################################################################################
+def bench_map_size(results, quick, case_filter):
+
+    for side in ([20, 80] if quick else [20, 80, 320]):
+        for mode, options in (('serial', {}), ('batch32', {'batch_size': 32})):
+            name = 'execute_rrt/map=%dx%d/%s' % (side, side, mode)
+            if case_filter not in name:
+                continue
+            rng = random.Random(0)
+            np.random.seed(0)
+            bounds = (-5, side - 5, -5, side - 5)
+            goal = (side - 8, side - 8)
+            obstacles = make_obstacles(side * side // 16, rng, bounds, radius=0.8) + enclose_point(goal)
+            rrt_algo = RRT()
+            rrt_algo.load_env((-2, -2), goal, [], obstacles, bounds=bounds, **options)
+            results[name] = measure(
+                lambda i: rrt_algo.execute_rrt(i + 1), 300 if quick else 1000)
+
+
+################################################################################
+# Name : check_repair
+# Function : builds star shaped trees of random edges of up to step_size from a
+#            root next to a dynamic obstacle, on the lattice and in continuous
+#            mode, runs repair_tree and checks that every edge left in the tree
+#            is viable at that frame. Edges leaving the corner of an occupied
+#            cell are the ones a too small search radius misses. Returns the
+#            names of the failed cases
+################################################################################
+def check_repair(seeds, tree_size=20):
+
+    failures = []
+    for mode, options in (('lattice', {}), ('continuous', {'continuous': True})):
+        for seed in range(seeds):
+            rng = random.Random(seed)
+            cx, cy = rng.randrange(-3, 14), rng.randrange(-3, 14)
+            dynamic_obstacles = [{'initial_position': [(cx, cy)], 'velocity': (0, 0)}]
+            root = (cx + rng.uniform(-2, 2), cy + rng.uniform(-2, 2))
+            if 'continuous' not in options:
+                root = (round(root[0]), round(root[1]))
+
+            rrt_algo = RRT()
+            rrt_algo.load_env(root, (12, 12), dynamic_obstacles, [], replan=True, **options)
+            for i in range(1, tree_size):
+                angle = rng.uniform(0, 2 * math.pi)
+                length = rng.uniform(0, rrt_algo.step_size)
+                node = (root[0] + length * math.cos(angle), root[1] + length * math.sin(angle))
+                if not rrt_algo.continuous:
+                    # lattice edges are never longer than step_size
+                    node = (round(node[0]), round(node[1]))
+                    if rrt_algo.distance(node, root) > rrt_algo.step_size:
+                        continue
+                rrt_algo.add_node(node)
+                rrt_algo.add_edge(0)
+
+            rrt_algo.repair_tree(1)
+            x, y, parent = rrt_algo.x.tolist(), rrt_algo.y.tolist(), rrt_algo.parent.tolist()
+            alive = rrt_algo.tree.alive.tolist()
+            if not all(rrt_algo.check_node_viability((x[i], y[i]), (x[parent[i]], y[parent[i]]), 1)
+                       for i in range(len(x)) if alive[i] and parent[i] != i):
+                failures.append('repair/%s/seed=%d' % (mode, seed))
+                print('%-50s colliding edge left' % failures[-1])
+    print('%d repair case(s) checked, %d failure(s)' % (2 * seeds, len(failures)))
+    return failures
+
+
+################################################################################
+# Name : tree_bytes
+# Function : returns the co-ordinates, parents and alive flags of a tree as
+#            bytes, so two trees can be compared exactly
+################################################################################
+def tree_bytes(tree):
+    if tree is None:
+        return None
+    return (tree.x.tobytes(), tree.y.tobytes(), tree.parent.tobytes(), tree.alive.tobytes())
+
+
+################################################################################
+# Name : check_nn_equivalence
+# Function : runs the same seeded planner with nn_mode 'grid' and 'linear'
+#            (lattice with moving obstacles and replanning, batched, continuous
+#            and RRT-Connect) and checks that the trees are identical frame for
+#            frame. Afterwards GridIndex.nearest and within_radius of the grid
+#            planner are compared with a linear scan of its tree, which by then
+#            has removed nodes, at random and lattice points where ties are
+#            common. A small cell_size makes the ring search cross many cells.
+#            Returns the names of the failed cases
+################################################################################
+def check_nn_equivalence(seeds, frames=60, queries=50):
+
+    modes = (('replan', {'replan': True}), ('batch32', {'batch_size': 32, 'replan': True}),
+             ('continuous', {'continuous': True, 'replan': True}), ('connect', {'planner': 'connect'}))
+    failures = []
+    for seed in range(seeds):
+        mode, options = modes[seed % len(modes)]
+        rng = random.Random(seed)
+        obstacles = make_obstacles(rng.randrange(0, 20), rng, radius=0.8)
+        # the obstacles never reach the start, which would block the whole tree
+        dynamic_obstacles = [{'initial_position': [(rng.uniform(6, 12), rng.uniform(6, 12))],
+                              'velocity': (rng.uniform(-0.1, 0.1), rng.uniform(-0.1, 0.1))}
+                             for _ in range(rng.randrange(0, 4))]
+        cell_size = rng.choice([1.0, 2.5, 4.0])
+
+        planners = {}
+        for nn_mode in ('grid', 'linear'):
+            rrt_algo = RRT()
+            rrt_algo.load_env((-2, -2), (12, 12), dynamic_obstacles, obstacles,
+                              nn_mode=nn_mode, cell_size=cell_size, **options)
+            planners[nn_mode] = rrt_algo
+
+        name = 'nn/%s/seed=%d' % (mode, seed)
+        for frame in range(1, frames + 1):
+            trees = []
+            for nn_mode, rrt_algo in planners.items():
+                np.random.seed(seed * 1000 + frame)
+                rrt_algo.execute_rrt(frame)
+                trees.append((tree_bytes(rrt_algo.tree), tree_bytes(rrt_algo.goal_tree)))
+            if trees[0] != trees[1]:
+                failures.append(name)
+                print('%-50s trees differ at frame %d' % (name, frame))
+                break
+        else:
+            rrt_algo = planners['grid']
+            for i in range(queries):
+                point = (rng.uniform(-6, 16), rng.uniform(-6, 16))
+                if i % 2:
+                    point = (round(point[0]), round(point[1]))
+                radius = rng.uniform(0, 6)
+                if (rrt_algo.index.nearest(point)[0] != rrt_algo.nearest_neighbor_linear(point)[1]
+                        or rrt_algo.index.within_radius(point, radius)
+                        != [j for j, node in enumerate(zip(rrt_algo.x.tolist(), rrt_algo.y.tolist()))
+                            if rrt_algo.tree.alive[j] and rrt_algo.distance(node, point) <= radius]):
+                    failures.append(name)
+                    print('%-50s index query differs at %s' % (name, point))
+                    break
+    print('%d nearest neighbor case(s) checked, %d failure(s)' % (seeds, len(failures)))
+    return failures
+
+
+BENCHMARKS = [bench_nearest_neighbor, bench_get_line_points, bench_point_in_polygon,
+              bench_check_node_viability, bench_execute_rrt, bench_map_size]
+
+
+################################################################################
+# Name : compare
+# Function : prints the change of every case against a baseline and returns
+#            the names of the cases whose p50 latency regressed
+################################################################################
+def compare(results, baseline):
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['p50_ms'] / max(baseline[name]['p50_ms'], 1e-9)
+        flag = ''
+        if ratio > REGRESSION_FACTOR:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-50s p50 %9.4f ms -> %9.4f ms (x%.2f)%s'
+              % (name, baseline[name]['p50_ms'], result['p50_ms'], ratio, flag))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark the RRT hot paths')
+    parser.add_argument('--quick', action='store_true', help='smaller maps and trees')
+    parser.add_argument('--filter', default='', help='only run cases containing this string')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--save-baseline', nargs='?', const=BASELINE_FILE,
+                        help='write the results as a baseline JSON file (default: %(const)s)')
+    parser.add_argument('--compare', nargs='?', const=BASELINE_FILE,
+                        help='compare against a baseline JSON file (default: %(const)s)')
+    parser.add_argument('--check-only', action='store_true', help='only run the correctness checks')
+    args = parser.parse_args()
+
+    failures = check_repair(CHECK_SEEDS) + check_nn_equivalence(CHECK_SEEDS)
+    if args.check_only:
+        sys.exit(1 if failures else 0)
+
+    results = {}
+    for benchmark in BENCHMARKS:
+        benchmark(results, args.quick, args.filter)
+
+    for name, result in results.items():
+        print('%-50s %12.1f ops/s  p50 %9.4f ms  p99 %9.4f ms  peak %9.1f KiB'
+              % (name, result['ops_per_sec'], result['p50_ms'], result['p99_ms'], result['peak_kib']))
+
+    for filename in (args.output, args.save_baseline):
+        if filename:
+            with open(filename, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            print('%d case(s) regressed by more than %d%%'
+                  % (len(regressions), round(100 * (REGRESSION_FACTOR - 1))))
+
+    if failures or regressions:
+        sys.exit(1)
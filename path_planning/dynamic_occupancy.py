@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+################################################################################
+# File - dynamic_occupancy.py
+# Function - Per frame cache of the lattice cells occupied by dynamic obstacles
+################################################################################
+
+from obstacle_bvh import segment_intersects_box
+
+
+################################################################################
+# Name : DynamicOccupancy
+# Function : Builds the set of cells occupied by the dynamic obstacles once per
+#            frame. locate(obstacle, frame) returns the obstacle location and
+#            footprint(point) the cells it occupies (RRT passes its
+#            get_dynamic_obstacle_location and get_neighbor_pixels). Frames
+#            older than the current frame are evicted by advance. With a
+#            horizon the checks are time-aware: a cell counts as occupied in a
+#            frame if it is occupied in that frame or any of the next horizon
+#            frames, so a new edge stays clear while the obstacles move on
+################################################################################
+
+class DynamicOccupancy:
+
+    def __init__(self, obstacles, locate, footprint, horizon=0):
+
+        self.obstacles = obstacles
+        self.locate = locate
+        self.footprint = footprint
+        self.horizon = horizon
+
+        # frame -> set of (x, y) cells
+        self.frames = {}
+
+    ################################################################################
+    # Name : build
+    # Function : computes the occupied cells for a frame
+    ################################################################################
+    def build(self, frame):
+
+        cells = set()
+        for obstacle in self.obstacles:
+            obstacle_point = self.locate(obstacle, frame)
+            cells.update(self.footprint(
+                (int(obstacle_point[0][0]), int(obstacle_point[1][0]))))
+
+        self.frames[frame] = cells
+        return cells
+
+    ################################################################################
+    # Name : get
+    # Function : returns the cached cells of a frame, building them if needed
+    ################################################################################
+    def get(self, frame):
+        cells = self.frames.get(frame)
+        if cells is None:
+            cells = self.build(frame)
+        return cells
+
+    ################################################################################
+    # Name : advance
+    # Function : evicts the frames before the given frame and builds the frames
+    #            up to frame + horizon
+    ################################################################################
+    def advance(self, frame):
+        for old_frame in [f for f in self.frames if f < frame]:
+            del self.frames[old_frame]
+        for f in range(frame, frame + self.horizon + 1):
+            self.get(f)
+
+    ################################################################################
+    # Name : cells
+    # Function : returns the set of (x, y) cells occupied from a frame to frame
+    #            + horizon
+    ################################################################################
+    def cells(self, frame):
+        if self.horizon == 0:
+            return self.get(frame)
+        cells = set()
+        for f in range(frame, frame + self.horizon + 1):
+            cells.update(self.get(f))
+        return cells
+
+    ################################################################################
+    # Name : collides
+    # Function : checks whether any of a list of points is occupied in any frame
+    #            from frame to frame + horizon
+    ################################################################################
+    def collides(self, points, frame):
+        for f in range(frame, frame + self.horizon + 1):
+            cells = self.get(f)
+            for point in points:
+                if (point[0], point[1]) in cells:
+                    return True
+        return False
+
+    ################################################################################
+    # Name : segment_collides
+    # Function : continuous version of collides, checks whether the segment p-q
+    #            passes through the unit square around any cell occupied from
+    #            frame to frame + horizon
+    ################################################################################
+    def segment_collides(self, p, q, frame):
+        for cx, cy in self.cells(frame):
+            if segment_intersects_box(p, q, (cx - 0.5, cy - 0.5, cx + 0.5, cy + 0.5)):
+                return True
+        return False
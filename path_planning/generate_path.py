@@ -1,10 +1,27 @@
 #!/usr/bin/env python3
 
-
-import matplotlib.pyplot as plt
-import math
+################################################################################
+# File - generate_path.py
+# Function - Runs and animates the path planning simulation. The RRT edges
+#            are kept in a single LineCollection which grows in place, the
+#            static scenery is drawn once, and only the changed artists are
+#            redrawn each frame (blitting). With --export the frames are
+#            rendered offscreen with Agg and written as a PNG sequence.
+#
+# Usage - python3 generate_path.py
+#         python3 generate_path.py --export frames --frames 500
+################################################################################
+
+import argparse
+import os
 import random
-from matplotlib.animation import FuncAnimation
+
+import matplotlib.image
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from matplotlib.path import Path
 from RRT import RRT
 
 # obstacle type flag
@@ -23,21 +40,25 @@ def get_dynamic_obstacle_location(obstacle, frame):
 # initializing the RRT planner object
 rrt_algo = RRT()
 
+# time budget of one RRT step, kept below the 250 ms animation interval
+rrt_budget_ms = 200
+
 # Generate a path from start to goal avoiding static and dynamic obstacles
 
 
-def generate_path(start_point, goal_point, dynamic_obstacles, static_obstacles, frame):
+def generate_path(start_point, goal_point, dynamic_obstacles, static_obstacles, frame,
+                  planner=rrt_algo):
 
     if frame == 0:
-        rrt_algo.load_env(start_point, goal_point,
-                          dynamic_obstacles, static_obstacles)
+        planner.load_env(start_point, goal_point,
+                         dynamic_obstacles, static_obstacles)
 
     else:
-        rrt_algo.execute_rrt(frame)
+        planner.execute_rrt(frame, budget_ms=rrt_budget_ms, max_expansions=1)
 
-    x_list = rrt_algo.x
-    y_list = rrt_algo.y
-    parent_list = rrt_algo.parent
+    x_list = planner.x
+    y_list = planner.y
+    parent_list = planner.parent
 
     # Get newest node
     point = (x_list[-1], y_list[-1])
@@ -65,69 +86,188 @@ static_obstacles = [
 ]
 
 
-# Define the dynamic obstacles as a list of points
-dynamic_obstacles = [
-    {'initial_position': [
-        (10, 1)], "velocity": [random.uniform(-1, 1), random.uniform(-1, 1)]},
-    {'initial_position': [
-        (2.5, 10)], "velocity": [random.uniform(-1, 1)*.5, random.uniform(-1, 1)*.5]},
-    {'initial_position': [
-        (5, 5)], "velocity": [random.uniform(-1, 1)*.2, random.uniform(-1, 1)*.2]},
-    {'initial_position': [
-        (0, 2.5)], "velocity": [random.uniform(-1, 1)*.1, random.uniform(-1, 1)*.1]}
-]
-
-# Define functions to plot obstacles
-
-
-def plot_polygon(polygon, color):
-    x, y = zip(*polygon)
-    axes.fill(x, y, color=color)
-
-
-fig = plt.figure(figsize=(5, 5))
-axes = fig.add_subplot(111)
-plt.xlim(-5, 15)
-plt.ylim(-5, 15)
-plt.xlabel('X')
-plt.ylabel('Y')
-
-dynamic_obstacles_location = []
-
-for i, obstacle in enumerate(dynamic_obstacles):
-    point, = axes.plot([], [], 'ok', ms=20)
-    dynamic_obstacles_location.append(point)
-
-
-for i, obstacle in enumerate(static_obstacles):
-    plot_polygon(obstacle, 'darkgray')
-
-
-def update_animation(frame):
-
-    # update dynamic obstacles
-    for i, obstacle in enumerate(dynamic_obstacles):
-        x, y = get_dynamic_obstacle_location(obstacle, frame+1)
-        dynamic_obstacles_location[i].set_data(x, y)
-
-    # TODO: you may compute the path here!
-    path = generate_path(start, goal, dynamic_obstacles,
-                         static_obstacles, frame)
-
-    # Plot the path as a red line up to the current frame
-    x = [i[0] for i in path[:frame+1]]
-    y = [i[1] for i in path[:frame+1]]
-    axes.plot(x, y, color='red')
-
-    # Plot the start and goal points as green and blue circles, respectively
-    axes.scatter(start[0], start[1], color='green', s=100)
-    axes.scatter(goal[0], goal[1], color='blue', s=100)
-    return []
-
-
-# Create the animation using FuncAnimation
-animation = FuncAnimation(fig, update_animation,
-                          frames=45, interval=250, blit=True)
-
-# Show the plot
-plt.show()
+################################################################################
+# Name : make_dynamic_obstacles
+# Function : returns the dynamic obstacles as a list of points with random
+#            velocities
+################################################################################
+def make_dynamic_obstacles():
+    return [
+        {'initial_position': [
+            (10, 1)], "velocity": [random.uniform(-1, 1), random.uniform(-1, 1)]},
+        {'initial_position': [
+            (2.5, 10)], "velocity": [random.uniform(-1, 1)*.5, random.uniform(-1, 1)*.5]},
+        {'initial_position': [
+            (5, 5)], "velocity": [random.uniform(-1, 1)*.2, random.uniform(-1, 1)*.2]},
+        {'initial_position': [
+            (0, 2.5)], "velocity": [random.uniform(-1, 1)*.1, random.uniform(-1, 1)*.1]}
+    ]
+
+
+################################################################################
+# Name : PathAnimation
+# Function : Owns the figure of the simulation of an RRT planner. The static
+#            obstacles and the start and goal markers are drawn once, while
+#            the dynamic obstacles and the tree edges are animated artists
+#            that update returns for blitting
+################################################################################
+
+class PathAnimation:
+
+    def __init__(self, planner, start, goal, dynamic_obstacles, static_obstacles, figure=None):
+
+        self.planner = planner
+        self.start = start
+        self.goal = goal
+        self.dynamic_obstacles = dynamic_obstacles
+        self.static_obstacles = static_obstacles
+
+        self.fig = figure if figure is not None else Figure(figsize=(5, 5))
+        self.axes = self.fig.add_subplot(111)
+        self.axes.set_xlim(-5, 15)
+        self.axes.set_ylim(-5, 15)
+        self.axes.set_xlabel('X')
+        self.axes.set_ylabel('Y')
+
+        for obstacle in static_obstacles:
+            self.plot_polygon(obstacle, 'darkgray')
+
+        # Plot the start and goal points as green and blue circles, respectively
+        self.axes.scatter(start[0], start[1], color='green', s=100, zorder=3)
+        self.axes.scatter(goal[0], goal[1], color='blue', s=100, zorder=3)
+
+        # tree edges, one path per node, appended as the tree grows
+        self.edge_count = 0
+        self.edges = LineCollection([], colors='red', animated=True)
+        self.axes.add_collection(self.edges)
+
+        self.obstacle_markers, = self.axes.plot([], [], 'ok', ms=20, animated=True)
+
+    # Define functions to plot obstacles
+    def plot_polygon(self, polygon, color):
+        x, y = zip(*polygon)
+        self.axes.fill(x, y, color=color)
+
+    ################################################################################
+    # Name : artists
+    # Function : returns the artists which change between frames
+    ################################################################################
+    def artists(self):
+        return [self.edges, self.obstacle_markers]
+
+    ################################################################################
+    # Name : add_new_edges
+    # Function : appends a path to the edge collection for every node added to
+    #            the tree since the last call and returns whether any was added.
+    #            The paths of the edges drawn before are left as they are, so a
+    #            frame only costs as much as its new edges
+    ################################################################################
+    def add_new_edges(self):
+
+        node_count = len(self.planner.tree)
+        if node_count == self.edge_count:
+            return False
+
+        x = self.planner.x
+        y = self.planner.y
+        parent = self.planner.parent
+        paths = self.edges.get_paths()
+        for node_id in range(self.edge_count, node_count):
+            parent_id = int(parent[node_id])
+            if parent_id != node_id:
+                paths.append(Path([(float(x[parent_id]), float(y[parent_id])),
+                                   (float(x[node_id]), float(y[node_id]))]))
+        self.edge_count = node_count
+        self.edges.stale = True
+        return True
+
+    ################################################################################
+    # Name : update
+    # Function : advances the simulation by one frame and returns the changed
+    #            artists
+    ################################################################################
+    def update(self, frame):
+
+        # update dynamic obstacles
+        x = []
+        y = []
+        for obstacle in self.dynamic_obstacles:
+            obstacle_x, obstacle_y = get_dynamic_obstacle_location(obstacle, frame+1)
+            x.extend(obstacle_x)
+            y.extend(obstacle_y)
+        self.obstacle_markers.set_data(x, y)
+
+        # TODO: you may compute the path here!
+        generate_path(self.start, self.goal, self.dynamic_obstacles,
+                      self.static_obstacles, frame, self.planner)
+        self.add_new_edges()
+
+        return self.artists()
+
+    ################################################################################
+    # Name : show
+    # Function : runs the animation in an interactive window. The figure must
+    #            have been created through pyplot
+    ################################################################################
+    def show(self, frames, interval):
+
+        import matplotlib.pyplot as plt
+        from matplotlib.animation import FuncAnimation
+
+        # Create the animation using FuncAnimation
+        self.animation = FuncAnimation(self.fig, self.update, frames=frames,
+                                       init_func=self.artists, interval=interval,
+                                       blit=True, repeat=False)
+
+        # Show the plot
+        plt.show()
+
+    ################################################################################
+    # Name : export
+    # Function : renders frames offscreen with Agg and writes them to
+    #            directory/frame_00000.png, ... The static background is drawn
+    #            once and restored before the animated artists of each frame
+    #            are drawn on top of it
+    ################################################################################
+    def export(self, frames, directory, dpi=100):
+
+        os.makedirs(directory, exist_ok=True)
+        self.fig.set_dpi(dpi)
+        canvas = FigureCanvasAgg(self.fig)
+        canvas.draw()
+        background = canvas.copy_from_bbox(self.fig.bbox)
+
+        for frame in range(frames):
+            self.update(frame)
+            canvas.restore_region(background)
+            for artist in self.artists():
+                self.axes.draw_artist(artist)
+            matplotlib.image.imsave(os.path.join(directory, 'frame_%05d.png' % frame),
+                                    np.asarray(canvas.buffer_rgba()))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Run the path planning simulation')
+    parser.add_argument('--frames', type=int, default=45, help='number of frames')
+    parser.add_argument('--interval', type=int, default=250, help='ms between frames')
+    parser.add_argument('--export', metavar='DIR',
+                        help='render headless and write the frames as PNGs to DIR')
+    parser.add_argument('--seed', type=int, help='seed of the obstacle velocities and the planner')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+
+    # Define the dynamic obstacles as a list of points
+    dynamic_obstacles = make_dynamic_obstacles()
+
+    if args.export:
+        path_animation = PathAnimation(rrt_algo, start, goal, dynamic_obstacles, static_obstacles)
+        path_animation.export(args.frames, args.export)
+    else:
+        import matplotlib.pyplot as plt
+        path_animation = PathAnimation(rrt_algo, start, goal, dynamic_obstacles, static_obstacles,
+                                       plt.figure(figsize=(5, 5)))
+        path_animation.show(args.frames, args.interval)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+################################################################################
+# File - obstacle_bvh.py
+# Function - Exact segment vs polygon collision checks for continuous
+#            co-ordinates, with a bounding volume hierarchy over the polygons
+#            so that a segment is only tested against polygons whose bounding
+#            boxes it overlaps
+################################################################################
+
+
+################################################################################
+# Name : orientation
+# Function : returns >0, <0 or 0 if c is left of, right of or on the line a-b
+################################################################################
+def orientation(a, b, c):
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+
+################################################################################
+# Name : on_segment
+# Function : checks if a point c, collinear with a-b, lies on the segment a-b
+################################################################################
+def on_segment(a, b, c):
+    return (min(a[0], b[0]) <= c[0] <= max(a[0], b[0]) and
+            min(a[1], b[1]) <= c[1] <= max(a[1], b[1]))
+
+
+################################################################################
+# Name : segments_intersect
+# Function : checks if the segments p1-p2 and q1-q2 intersect (touching counts)
+################################################################################
+def segments_intersect(p1, p2, q1, q2):
+
+    d1 = orientation(q1, q2, p1)
+    d2 = orientation(q1, q2, p2)
+    d3 = orientation(p1, p2, q1)
+    d4 = orientation(p1, p2, q2)
+
+    if ((d1 > 0 and d2 < 0) or (d1 < 0 and d2 > 0)) and \
+            ((d3 > 0 and d4 < 0) or (d3 < 0 and d4 > 0)):
+        return True
+
+    return ((d1 == 0 and on_segment(q1, q2, p1)) or
+            (d2 == 0 and on_segment(q1, q2, p2)) or
+            (d3 == 0 and on_segment(p1, p2, q1)) or
+            (d4 == 0 and on_segment(p1, p2, q2)))
+
+
+################################################################################
+# Name : point_in_polygon
+# Function : ray casting test with the same rule as RRT.point_in_polygon
+################################################################################
+def point_in_polygon(point, polygon):
+    x, y = point
+    n = len(polygon)
+    inside = False
+    for i in range(n):
+        p1x, p1y = polygon[i]
+        p2x, p2y = polygon[(i + 1) % n]
+        if min(p1y, p2y) < y <= max(p1y, p2y) and x <= max(p1x, p2x):
+            if p1x == p2x or x <= (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x:
+                inside = not inside
+    return inside
+
+
+################################################################################
+# Name : segment_intersects_polygon
+# Function : checks if the segment p-q touches the boundary or the inside of
+#            a polygon
+################################################################################
+def segment_intersects_polygon(p, q, polygon):
+
+    n = len(polygon)
+    for i in range(n):
+        if segments_intersect(p, q, polygon[i], polygon[(i + 1) % n]):
+            return True
+
+    # no edge is crossed, so the segment is either fully inside or outside
+    return point_in_polygon(p, polygon)
+
+
+################################################################################
+# Name : segment_intersects_box
+# Function : checks if the segment p-q overlaps the box (xmin, ymin, xmax, ymax)
+#            using the slab method
+################################################################################
+def segment_intersects_box(p, q, box):
+
+    xmin, ymin, xmax, ymax = box
+    t0, t1 = 0.0, 1.0
+    for start, delta, low, high in ((p[0], q[0] - p[0], xmin, xmax),
+                                    (p[1], q[1] - p[1], ymin, ymax)):
+        if delta == 0:
+            if start < low or start > high:
+                return False
+            continue
+        ta = (low - start) / delta
+        tb = (high - start) / delta
+        if ta > tb:
+            ta, tb = tb, ta
+        t0 = max(t0, ta)
+        t1 = min(t1, tb)
+        if t0 > t1:
+            return False
+    return True
+
+
+################################################################################
+# Name : ObstacleBVH
+# Function : Binary tree of bounding boxes over a list of polygons. Every node
+#            is [box, left child, right child, polygon indices], where only
+#            leaves hold polygon indices. Built top down by splitting the
+#            polygons at the median of the longest axis
+################################################################################
+
+class ObstacleBVH:
+
+    def __init__(self, polygons, leaf_size=4):
+
+        self.polygons = polygons
+        self.leaf_size = leaf_size
+        self.boxes = []
+        for polygon in polygons:
+            xs = [point[0] for point in polygon]
+            ys = [point[1] for point in polygon]
+            self.boxes.append((min(xs), min(ys), max(xs), max(ys)))
+
+        self.root = self.build(list(range(len(polygons)))) if polygons else None
+
+    ################################################################################
+    # Name : build
+    # Function : builds the subtree over a list of polygon indices
+    ################################################################################
+    def build(self, indices):
+
+        boxes = [self.boxes[i] for i in indices]
+        box = (min(b[0] for b in boxes), min(b[1] for b in boxes),
+               max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+        if len(indices) <= self.leaf_size:
+            return [box, None, None, indices]
+
+        # split along the longest axis of the box at the median centre
+        axis = 0 if box[2] - box[0] >= box[3] - box[1] else 1
+        indices = sorted(indices, key=lambda i: self.boxes[i][axis] + self.boxes[i][axis + 2])
+        middle = len(indices) // 2
+        return [box, self.build(indices[:middle]), self.build(indices[middle:]), None]
+
+    ################################################################################
+    # Name : query_segment
+    # Function : returns the indices of the polygons whose bounding boxes the
+    #            segment p-q overlaps
+    ################################################################################
+    def query_segment(self, p, q):
+
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            box, left, right, indices = stack.pop()
+            if not segment_intersects_box(p, q, box):
+                continue
+            if indices is None:
+                stack.append(left)
+                stack.append(right)
+            else:
+                found.extend(i for i in indices if segment_intersects_box(p, q, self.boxes[i]))
+        return found
+
+    ################################################################################
+    # Name : segment_collides
+    # Function : checks if the segment p-q intersects any polygon
+    ################################################################################
+    def segment_collides(self, p, q):
+        for i in self.query_segment(p, q):
+            if segment_intersects_polygon(p, q, self.polygons[i]):
+                return True
+        return False
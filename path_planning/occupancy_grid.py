@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+################################################################################
+# File - occupancy_grid.py
+# Function - Boolean occupancy grid of the workspace which is rasterized once
+#            from the static obstacle polygons (or read from a raster on disk)
+#            and queried with array lookups
+################################################################################
+
+import json
+import math
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+################################################################################
+# Name : polygon_bounds
+# Function : returns the bounds (xmin, xmax, ymin, ymax) of a list of polygons
+#            grown by margin and snapped outwards to multiples of resolution,
+#            or None if there are no polygons
+################################################################################
+def polygon_bounds(polygons, resolution=1.0, margin=0.0):
+
+    if not polygons:
+        return None
+
+    xs = [point[0] for polygon in polygons for point in polygon]
+    ys = [point[1] for polygon in polygons for point in polygon]
+    return (math.floor((min(xs) - margin) / resolution) * resolution,
+            math.ceil((max(xs) + margin) / resolution) * resolution,
+            math.floor((min(ys) - margin) / resolution) * resolution,
+            math.ceil((max(ys) + margin) / resolution) * resolution)
+
+
+################################################################################
+# Name : OccupancyGrid
+# Function : Grid of the lattice points in bounds (xmin, xmax, ymin, ymax).
+#            data[row, col] is True if the point (xmin + col * resolution,
+#            ymin + row * resolution) lies inside an obstacle. data may also be
+#            a uint8 raster (nonzero is occupied), e.g. a numpy.memmap
+################################################################################
+
+class OccupancyGrid:
+
+    def __init__(self, bounds, resolution=1.0, data=None):
+
+        self.xmin, self.xmax, self.ymin, self.ymax = bounds
+        self.resolution = float(resolution)
+
+        self.width = int(round((self.xmax - self.xmin) / self.resolution)) + 1
+        self.height = int(round((self.ymax - self.ymin) / self.resolution)) + 1
+
+        if data is None:
+            data = np.zeros((self.height, self.width), dtype=bool)
+        elif data.shape != (self.height, self.width):
+            raise ValueError("grid data of shape %s does not match bounds %s at resolution %g"
+                             % (data.shape, bounds, self.resolution))
+        self.data = data
+
+    ################################################################################
+    # Name : bounds
+    # Function : returns (xmin, xmax, ymin, ymax)
+    ################################################################################
+    @property
+    def bounds(self):
+        return (self.xmin, self.xmax, self.ymin, self.ymax)
+
+    ################################################################################
+    # Name : from_npy
+    # Function : loads a 2D .npy raster. With mmap the file is memory mapped
+    #            and only the pages that are looked up are read. The origin
+    #            (xmin, ymin) and resolution are read from a sidecar .json file
+    #            written by save_npy unless they are given (default origin (0, 0)
+    #            and resolution 1)
+    ################################################################################
+    @classmethod
+    def from_npy(cls, filename, origin=None, resolution=None, mmap=True):
+
+        data = np.load(filename, mmap_mode='r' if mmap else None)
+        if data.ndim != 2:
+            raise ValueError("occupancy raster must be 2D, got shape %s" % (data.shape,))
+
+        meta = {}
+        meta_filename = os.path.splitext(filename)[0] + '.json'
+        if os.path.exists(meta_filename):
+            with open(meta_filename) as f:
+                meta = json.load(f)
+
+        if origin is None:
+            origin = meta.get('origin', (0.0, 0.0))
+        if resolution is None:
+            resolution = meta.get('resolution', 1.0)
+
+        xmin, ymin = origin
+        height, width = data.shape
+        bounds = (xmin, xmin + (width - 1) * resolution, ymin, ymin + (height - 1) * resolution)
+        return cls(bounds, resolution, data)
+
+    ################################################################################
+    # Name : save_npy
+    # Function : writes the grid to a .npy raster and its origin and resolution
+    #            to a sidecar .json file
+    ################################################################################
+    def save_npy(self, filename):
+        np.save(filename, np.asarray(self.data))
+        with open(os.path.splitext(filename)[0] + '.json', 'w') as f:
+            json.dump({'origin': [self.xmin, self.ymin], 'resolution': self.resolution}, f)
+
+    ################################################################################
+    # Name : from_polygons
+    # Function : builds a grid from a list of polygons using the same ray
+    #            casting rule as RRT.point_in_polygon
+    ################################################################################
+    @classmethod
+    def from_polygons(cls, polygons, bounds, resolution=1.0):
+
+        grid = cls(bounds, resolution)
+        for polygon in polygons:
+            grid.add_polygon(polygon)
+        return grid
+
+    ################################################################################
+    # Name : add_polygon
+    # Function : marks the lattice points inside a polygon as occupied. Only the
+    #            bounding box of the polygon is evaluated since points outside of
+    #            it can never be inside
+    ################################################################################
+    def add_polygon(self, polygon):
+
+        px = [p[0] for p in polygon]
+        py = [p[1] for p in polygon]
+
+        col0 = max(int(math.floor((min(px) - self.xmin) / self.resolution)), 0)
+        col1 = min(int(math.ceil((max(px) - self.xmin) / self.resolution)), self.width - 1)
+        row0 = max(int(math.floor((min(py) - self.ymin) / self.resolution)), 0)
+        row1 = min(int(math.ceil((max(py) - self.ymin) / self.resolution)), self.height - 1)
+        if col0 > col1 or row0 > row1:
+            return
+
+        x = self.xmin + np.arange(col0, col1 + 1) * self.resolution
+        y = self.ymin + np.arange(row0, row1 + 1) * self.resolution
+        x, y = np.meshgrid(x, y)
+
+        inside = np.zeros(x.shape, dtype=bool)
+        n = len(polygon)
+        for i in range(n):
+            p1x, p1y = polygon[i]
+            p2x, p2y = polygon[(i + 1) % n]
+
+            # horizontal edges never toggle the ray casting result
+            if p1y == p2y:
+                continue
+
+            crossing = (y > min(p1y, p2y)) & (y <= max(p1y, p2y)) & (x <= max(p1x, p2x))
+            if p1x != p2x:
+                x_inters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
+                crossing &= x <= x_inters
+            inside ^= crossing
+
+        self.data[row0:row1 + 1, col0:col1 + 1] |= inside
+
+    ################################################################################
+    # Name : inflate
+    # Function : returns a new grid where every point within radius of an
+    #            occupied point is also occupied
+    ################################################################################
+    def inflate(self, radius):
+
+        r = int(math.floor(radius / self.resolution))
+        data = np.array(self.data != 0)
+        source = data.copy()
+        if r <= 0:
+            return OccupancyGrid(self.bounds, self.resolution, data)
+
+        for dy in range(-r, r + 1):
+            for dx in range(-r, r + 1):
+                if (dx == 0 and dy == 0) or dx * dx + dy * dy > r * r:
+                    continue
+                dst_rows = slice(max(dy, 0), self.height + min(dy, 0))
+                src_rows = slice(max(-dy, 0), self.height + min(-dy, 0))
+                dst_cols = slice(max(dx, 0), self.width + min(dx, 0))
+                src_cols = slice(max(-dx, 0), self.width + min(-dx, 0))
+                data[dst_rows, dst_cols] |= source[src_rows, src_cols]
+
+        return OccupancyGrid(self.bounds, self.resolution, data)
+
+    ################################################################################
+    # Name : lookup
+    # Function : returns two bool arrays for arrays of x and y co-ordinates,
+    #            whether each point is occupied and whether it lies in the grid
+    ################################################################################
+    def lookup(self, x, y):
+
+        cols = np.rint((np.asarray(x, dtype=float) - self.xmin) / self.resolution).astype(np.int64)
+        rows = np.rint((np.asarray(y, dtype=float) - self.ymin) / self.resolution).astype(np.int64)
+
+        inside = (cols >= 0) & (cols < self.width) & (rows >= 0) & (rows < self.height)
+        occupied = np.zeros(inside.shape, dtype=bool)
+        occupied[inside] = self.read(rows[inside], cols[inside])
+        return occupied, inside
+
+    ################################################################################
+    # Name : read
+    # Function : returns whether the cells at arrays of rows and columns (all
+    #            inside the grid) are occupied
+    ################################################################################
+    def read(self, rows, cols):
+        return self.data[rows, cols] != 0
+
+
+################################################################################
+# Name : TiledOccupancyGrid
+# Function : OccupancyGrid for rasters that are too large for RAM. Lookups are
+#            grouped by square tile of tile_size cells, and at most max_tiles
+#            tiles are kept in memory (least recently used tiles are dropped)
+################################################################################
+
+class TiledOccupancyGrid(OccupancyGrid):
+
+    def __init__(self, bounds, resolution=1.0, data=None, tile_size=512, max_tiles=64):
+
+        super().__init__(bounds, resolution, data)
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()
+
+    ################################################################################
+    # Name : from_grid
+    # Function : wraps the (usually memory mapped) data of another grid
+    ################################################################################
+    @classmethod
+    def from_grid(cls, grid, tile_size=512, max_tiles=64):
+        return cls(grid.bounds, grid.resolution, grid.data, tile_size, max_tiles)
+
+    ################################################################################
+    # Name : get_tile
+    # Function : returns the tile at a tile row and column as a bool array
+    ################################################################################
+    def get_tile(self, tile_row, tile_col):
+
+        key = (tile_row, tile_col)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+
+        row0 = tile_row * self.tile_size
+        col0 = tile_col * self.tile_size
+        tile = np.array(self.data[row0:row0 + self.tile_size, col0:col0 + self.tile_size] != 0)
+        self.tiles[key] = tile
+        if len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return tile
+
+    ################################################################################
+    # Name : read
+    # Function : looks up the cells tile by tile
+    ################################################################################
+    def read(self, rows, cols):
+
+        tile_rows = rows // self.tile_size
+        tile_cols = cols // self.tile_size
+        tile_ids = tile_rows * (self.width // self.tile_size + 1) + tile_cols
+
+        occupied = np.empty(rows.shape, dtype=bool)
+        for tile_id in np.unique(tile_ids):
+            mask = tile_ids == tile_id
+            i = np.flatnonzero(mask)[0]
+            tile = self.get_tile(int(tile_rows[i]), int(tile_cols[i]))
+            occupied[mask] = tile[rows[mask] % self.tile_size, cols[mask] % self.tile_size]
+        return occupied
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+################################################################################
+# File - planner_stats.py
+# Function - Opt-in counters and timers for the RRT planner. Nothing in this
+#            file runs unless RRT.enable_stats is called
+################################################################################
+
+import time
+
+
+################################################################################
+# Name : PlannerStats
+# Function : Collects call counts and times of wrapped functions and frame
+#            counters, both for the current frame and cumulatively. Values are
+#            read as flat dicts, e.g. {'nearest_neighbor_calls': 12,
+#            'nearest_neighbor_ms': 0.4, 'samples': 12, 'rejected': 11, ...}
+################################################################################
+
+class PlannerStats:
+
+    def __init__(self, keep_history=True):
+
+        self.current = {}
+        self.total = {}
+        self.last_frame = {}
+        self.keep_history = keep_history
+
+        # list of the per frame dicts of every finished frame
+        self.history = []
+
+    ################################################################################
+    # Name : add
+    # Function : adds a value to a counter of the current frame and the total
+    ################################################################################
+    def add(self, name, value=1):
+        self.current[name] = self.current.get(name, 0) + value
+        self.total[name] = self.total.get(name, 0) + value
+
+    ################################################################################
+    # Name : wrap
+    # Function : returns fn wrapped so that every call adds to <name>_calls and
+    #            <name>_ms
+    ################################################################################
+    def wrap(self, name, fn):
+
+        calls = name + '_calls'
+        ms = name + '_ms'
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(ms, 1000.0 * (time.perf_counter() - start))
+                self.add(calls)
+
+        return timed
+
+    ################################################################################
+    # Name : end_frame
+    # Function : closes the current frame, adding the given frame counters
+    #            (samples, rejected, ...), and returns its dict. nodes is the
+    #            size of the tree at the end of the frame
+    ################################################################################
+    def end_frame(self, frame, nodes, **counters):
+
+        for name, value in counters.items():
+            self.add(name, value)
+
+        frame_stats = dict(self.current)
+        frame_stats['frame'] = frame
+        frame_stats['nodes'] = nodes
+
+        self.total['frames'] = self.total.get('frames', 0) + 1
+        self.total['nodes'] = nodes
+
+        if self.keep_history:
+            self.history.append(frame_stats)
+        self.last_frame = frame_stats
+        self.current = {}
+        return frame_stats
+
+    ################################################################################
+    # Name : frame_stats
+    # Function : returns the dict of the last finished frame
+    ################################################################################
+    def frame_stats(self):
+        return dict(self.last_frame)
+
+    ################################################################################
+    # Name : total_stats
+    # Function : returns the cumulative dict over all finished frames
+    ################################################################################
+    def total_stats(self):
+        return dict(self.total)
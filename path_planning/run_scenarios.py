@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+################################################################################
+# File - run_scenarios.py
+# Function - Headless Monte-Carlo runner for the RRT planner. Scenarios are
+#            loaded from a JSON (or YAML) file and every scenario is run for a
+#            number of seeded trials across a process pool. One row per trial
+#            is written to a CSV file. matplotlib is never imported here.
+#
+# Usage - python3 run_scenarios.py scenarios/l_shape.json -o results.csv
+################################################################################
+
+import argparse
+import csv
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from RRT import RRT
+
+# columns of the output table
+FIELDS = ['scenario', 'trial', 'seed', 'success', 'frames_to_goal',
+          'nodes_to_goal', 'nodes', 'wall_time_s']
+
+
+################################################################################
+# Name : load_scenarios
+# Function : reads a list of scenarios from a .json, .yaml or .yml file. The
+#            file holds either a list of scenarios or {"scenarios": [...]}
+################################################################################
+def load_scenarios(filename):
+
+    with open(filename) as f:
+        if filename.endswith(('.yaml', '.yml')):
+            # PyYAML is only needed for YAML scenario files
+            import yaml
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+
+    if isinstance(data, dict):
+        data = data['scenarios']
+
+    for i, scenario in enumerate(data):
+        scenario.setdefault('name', 'scenario_%d' % i)
+        scenario.setdefault('frames', 45)
+        scenario.setdefault('trials', 1)
+        scenario.setdefault('dynamic_obstacles', [])
+        scenario.setdefault('planner', {})
+
+    return data
+
+
+################################################################################
+# Name : make_dynamic_obstacles
+# Function : returns the dynamic obstacles of a scenario in the format used by
+#            RRT. An obstacle either has a fixed "velocity" [vx, vy] or a
+#            "velocity_range" [[vx_min, vx_max], [vy_min, vy_max]] which is
+#            sampled with the trial's random generator
+################################################################################
+def make_dynamic_obstacles(scenario, rng):
+
+    obstacles = []
+    for obstacle in scenario['dynamic_obstacles']:
+        if 'velocity_range' in obstacle:
+            (vx_min, vx_max), (vy_min, vy_max) = obstacle['velocity_range']
+            velocity = [rng.uniform(vx_min, vx_max), rng.uniform(vy_min, vy_max)]
+        else:
+            velocity = list(obstacle['velocity'])
+
+        obstacles.append({'initial_position': [tuple(p) for p in obstacle['initial_position']],
+                          'velocity': velocity})
+    return obstacles
+
+
+################################################################################
+# Name : run_trial
+# Function : runs one seeded trial of a scenario the same way generate_path.py
+#            does (frame 0 loads the environment, every later frame runs one
+#            RRT step) and returns a row of the output table. With stats the
+#            row also holds the cumulative planner counters and timers
+################################################################################
+def run_trial(scenario, trial, seed, stats=False):
+
+    rng = random.Random(seed)
+    np.random.seed(seed % 2 ** 32)
+
+    dynamic_obstacles = make_dynamic_obstacles(scenario, rng)
+    static_obstacles = [[tuple(p) for p in polygon] for polygon in scenario['static_obstacles']]
+
+    start_time = time.perf_counter()
+
+    rrt_algo = RRT()
+    if stats:
+        rrt_algo.enable_stats(keep_history=False)
+    rrt_algo.load_env(tuple(scenario['start']), tuple(scenario['goal']),
+                      dynamic_obstacles, static_obstacles, **scenario['planner'])
+
+    for frame in range(1, scenario['frames']):
+        rrt_algo.execute_rrt(frame)
+        if rrt_algo.goal_status:
+            break
+
+    wall_time = time.perf_counter() - start_time
+
+    row = {'scenario': scenario['name'],
+           'trial': trial,
+           'seed': seed,
+           'success': int(rrt_algo.goal_status),
+           'frames_to_goal': '' if rrt_algo.solution_frame is None else rrt_algo.solution_frame,
+           'nodes_to_goal': '' if rrt_algo.solution_nodes is None else rrt_algo.solution_nodes,
+           'nodes': rrt_algo.node_count(),
+           'wall_time_s': round(wall_time, 6)}
+
+    if stats:
+        for name, value in rrt_algo.stats.total_stats().items():
+            row.setdefault(name, round(value, 6))
+    return row
+
+
+################################################################################
+# Name : run_job
+# Function : unpacks a (scenario, trial, seed, stats) job for the process pool
+################################################################################
+def run_job(job):
+    return run_trial(*job)
+
+
+################################################################################
+# Name : run_scenarios
+# Function : runs every trial of every scenario across a process pool and
+#            returns the rows in (scenario, trial) order
+################################################################################
+def run_scenarios(scenarios, seed=0, workers=None, stats=False):
+
+    jobs = []
+    for scenario in scenarios:
+        for trial in range(scenario['trials']):
+            jobs.append((scenario, trial, seed + trial, stats))
+
+    if workers == 1:
+        return [run_job(job) for job in jobs]
+
+    workers = workers or os.cpu_count()
+    chunksize = max(1, len(jobs) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_job, jobs, chunksize=chunksize))
+
+
+################################################################################
+# Name : write_csv
+# Function : writes the rows to a CSV file, planner stats columns (if any)
+#            come after the fixed columns
+################################################################################
+def write_csv(rows, filename):
+    extra = sorted(set(name for row in rows for name in row) - set(FIELDS))
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS + extra, restval='')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+################################################################################
+# Name : summarize
+# Function : returns per scenario success rate, mean frames and nodes to
+#            goal, mean node count and mean wall time
+################################################################################
+def summarize(rows):
+
+    summary = {}
+    for row in rows:
+        summary.setdefault(row['scenario'], []).append(row)
+
+    lines = []
+    for name, trials in summary.items():
+        solved = [row for row in trials if row['success']]
+        frames = np.mean([row['frames_to_goal'] for row in solved]) if solved else float('nan')
+        nodes = np.mean([row['nodes_to_goal'] for row in solved]) if solved else float('nan')
+        lines.append('%s: trials=%d success_rate=%.3f mean_frames_to_goal=%.2f mean_nodes_to_goal=%.1f '
+                     'mean_nodes=%.1f mean_wall_time_ms=%.3f'
+                     % (name, len(trials), len(solved) / len(trials), frames, nodes,
+                        np.mean([row['nodes'] for row in trials]),
+                        1000 * np.mean([row['wall_time_s'] for row in trials])))
+    return lines
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Run RRT scenarios headless')
+    parser.add_argument('scenario_file', help='.json, .yaml or .yml scenario file')
+    parser.add_argument('-o', '--output', default='results.csv', help='output CSV file')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first trial')
+    parser.add_argument('--trials', type=int, help='override the trial count of every scenario')
+    parser.add_argument('--workers', type=int, help='number of worker processes')
+    parser.add_argument('--stats', action='store_true', help='add planner counters and timers to every row')
+    args = parser.parse_args()
+
+    scenarios = load_scenarios(args.scenario_file)
+    if args.trials is not None:
+        for scenario in scenarios:
+            scenario['trials'] = args.trials
+
+    rows = run_scenarios(scenarios, seed=args.seed, workers=args.workers, stats=args.stats)
+    write_csv(rows, args.output)
+
+    for line in summarize(rows):
+        print(line)
+    print("Results written to " + args.output)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+################################################################################
+# File - spatial_index.py
+# Function - Uniform grid (bucket hash) index used by the RRT planner to answer
+#            nearest neighbor and radius queries without scanning every node
+################################################################################
+
+import math
+
+
+################################################################################
+# Name : GridIndex
+# Function : Stores node ids in square buckets of side cell_size. Nodes are
+#            added incrementally as the tree grows and queries only visit the
+#            buckets that can contain a closer node
+################################################################################
+
+class GridIndex:
+
+    def __init__(self, cell_size=4.0):
+
+        self.cell_size = float(cell_size)
+
+        # buckets maps a cell (cx, cy) to a list of (node_id, x, y) entries
+        self.buckets = {}
+        self.count = 0
+
+        # bounding box of the occupied cells, used to stop the ring search
+        self.min_cx = None
+        self.max_cx = None
+        self.min_cy = None
+        self.max_cy = None
+
+    ################################################################################
+    # Name : get_cell
+    # Function : returns the bucket co-ordinates of a point
+    ################################################################################
+    def get_cell(self, point):
+        x, y = point
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    ################################################################################
+    # Name : insert
+    # Function : adds a node id at the given point
+    ################################################################################
+    def insert(self, node_id, point):
+        x, y = point
+        cell = self.get_cell(point)
+        self.buckets.setdefault(cell, []).append((node_id, x, y))
+        self.count += 1
+
+        cx, cy = cell
+        if self.min_cx is None:
+            self.min_cx = self.max_cx = cx
+            self.min_cy = self.max_cy = cy
+        else:
+            self.min_cx = min(self.min_cx, cx)
+            self.max_cx = max(self.max_cx, cx)
+            self.min_cy = min(self.min_cy, cy)
+            self.max_cy = max(self.max_cy, cy)
+
+    ################################################################################
+    # Name : remove
+    # Function : removes a node id that was inserted at the given point. The
+    #            bounding box of the occupied cells is not shrunk
+    ################################################################################
+    def remove(self, node_id, point):
+        cell = self.get_cell(point)
+        bucket = self.buckets.get(cell, [])
+        entries = [entry for entry in bucket if entry[0] != node_id]
+        self.count -= len(bucket) - len(entries)
+        if entries:
+            self.buckets[cell] = entries
+        else:
+            self.buckets.pop(cell, None)
+
+    ################################################################################
+    # Name : get_ring
+    # Function : returns the cells at a Chebyshev distance of r from a cell
+    #            which lie in the bounding box of the occupied cells
+    ################################################################################
+    def get_ring(self, cell, r):
+        cx, cy = cell
+        if r == 0:
+            return [cell]
+
+        x0, x1 = max(cx - r, self.min_cx), min(cx + r, self.max_cx)
+        y0, y1 = max(cy - r + 1, self.min_cy), min(cy + r - 1, self.max_cy)
+
+        ring = []
+        for y in (cy - r, cy + r):
+            if self.min_cy <= y <= self.max_cy:
+                ring.extend((x, y) for x in range(x0, x1 + 1))
+        for x in (cx - r, cx + r):
+            if self.min_cx <= x <= self.max_cx:
+                ring.extend((x, y) for y in range(y0, y1 + 1))
+        return ring
+
+    ################################################################################
+    # Name : nearest
+    # Function : returns (node_id, (x, y)) of the node closest to a point.
+    #            Ties are broken by the lowest node id, which matches a linear
+    #            scan over the nodes in insertion order
+    ################################################################################
+    def nearest(self, point):
+
+        if self.count == 0:
+            return None, None
+
+        px, py = point
+        cell = self.get_cell(point)
+        cx, cy = cell
+
+        # the ring search never has to go past the furthest occupied cell, and
+        # starts at the first ring which reaches the occupied cells
+        max_ring = max(abs(cx - self.min_cx), abs(cx - self.max_cx),
+                       abs(cy - self.min_cy), abs(cy - self.max_cy))
+        min_ring = max(self.min_cx - cx, cx - self.max_cx, self.min_cy - cy, cy - self.max_cy, 0)
+
+        best_dist = float('inf')
+        best_id = None
+        best_point = None
+
+        for r in range(min_ring, max_ring + 1):
+
+            for ring_cell in self.get_ring(cell, r):
+                for node_id, x, y in self.buckets.get(ring_cell, ()):
+                    dist = math.sqrt((x - px) ** 2 + (y - py) ** 2)
+                    if dist < best_dist or (dist == best_dist and node_id < best_id):
+                        best_dist = dist
+                        best_id = node_id
+                        best_point = (x, y)
+
+            # every node in ring r + 1 is at least r * cell_size away
+            if best_dist < r * self.cell_size:
+                break
+
+        return best_id, best_point
+
+    ################################################################################
+    # Name : within_radius
+    # Function : returns the ids of all nodes within a distance of radius from
+    #            a point, sorted by node id
+    ################################################################################
+    def within_radius(self, point, radius):
+
+        if self.count == 0:
+            return []
+
+        px, py = point
+        min_cell = self.get_cell((px - radius, py - radius))
+        max_cell = self.get_cell((px + radius, py + radius))
+
+        node_ids = []
+        for x in range(max(min_cell[0], self.min_cx), min(max_cell[0], self.max_cx) + 1):
+            for y in range(max(min_cell[1], self.min_cy), min(max_cell[1], self.max_cy) + 1):
+                for node_id, nx, ny in self.buckets.get((x, y), ()):
+                    if math.sqrt((nx - px) ** 2 + (ny - py) ** 2) <= radius:
+                        node_ids.append(node_id)
+
+        node_ids.sort()
+        return node_ids
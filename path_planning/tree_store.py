@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+################################################################################
+# File - tree_store.py
+# Function - Array backed storage for the nodes and edges of an RRT tree
+################################################################################
+
+import numpy as np
+
+
+################################################################################
+# Name : TreeStore
+# Function : Stores the x-y co-ordinates and parent node number of every node
+#            in preallocated NumPy arrays (struct of arrays) which double in
+#            size whenever they are full. The root node is its own parent.
+#            Pruned nodes keep their node number but are marked as not alive
+################################################################################
+
+class TreeStore:
+
+    def __init__(self, capacity=1024, dtype=np.float32):
+
+        self.count = 0
+        self._x = np.empty(capacity, dtype=dtype)
+        self._y = np.empty(capacity, dtype=dtype)
+        self._parent = np.full(capacity, -1, dtype=np.int32)
+        self._alive = np.zeros(capacity, dtype=bool)
+
+    ################################################################################
+    # Name : x, y, parent, alive
+    # Function : views of the filled part of the arrays (no copy is made)
+    ################################################################################
+    @property
+    def x(self):
+        return self._x[:self.count]
+
+    @property
+    def y(self):
+        return self._y[:self.count]
+
+    @property
+    def parent(self):
+        return self._parent[:self.count]
+
+    @property
+    def alive(self):
+        return self._alive[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    ################################################################################
+    # Name : grow
+    # Function : doubles the capacity of the arrays. Views returned by x, y
+    #            and parent before the call keep pointing to the old arrays
+    ################################################################################
+    def grow(self):
+        capacity = 2 * len(self._x)
+
+        x = np.empty(capacity, dtype=self._x.dtype)
+        y = np.empty(capacity, dtype=self._y.dtype)
+        parent = np.full(capacity, -1, dtype=self._parent.dtype)
+        alive = np.zeros(capacity, dtype=bool)
+        x[:self.count] = self.x
+        y[:self.count] = self.y
+        parent[:self.count] = self.parent
+        alive[:self.count] = self.alive
+
+        self._x, self._y, self._parent, self._alive = x, y, parent, alive
+
+    ################################################################################
+    # Name : add_node
+    # Function : appends a node without a parent and returns its node number
+    #            together with the co-ordinates as they are stored
+    ################################################################################
+    def add_node(self, x, y):
+        if self.count == len(self._x):
+            self.grow()
+        node_id = self.count
+        self._x[node_id] = x
+        self._y[node_id] = y
+        self._alive[node_id] = True
+        self.count += 1
+        return node_id, (float(self._x[node_id]), float(self._y[node_id]))
+
+    ################################################################################
+    # Name : set_parent
+    # Function : connects a node to its parent
+    ################################################################################
+    def set_parent(self, node_id, parent):
+        self._parent[node_id] = parent
+
+    ################################################################################
+    # Name : get_subtree
+    # Function : returns the node numbers of a node and all of its descendants
+    ################################################################################
+    def get_subtree(self, node_id):
+
+        # group the node numbers by parent so the children of a node are
+        # order[start[node]:start[node + 1]]
+        parent = self.parent
+        order = np.argsort(parent, kind='stable')
+        start = np.searchsorted(parent[order], np.arange(self.count + 1))
+
+        subtree = [node_id]
+        i = 0
+        while i < len(subtree):
+            node = subtree[i]
+            for child in order[start[node]:start[node + 1]].tolist():
+                # the root is its own parent
+                if child != node:
+                    subtree.append(child)
+            i += 1
+        return np.array(subtree, dtype=np.int64)
+
+    ################################################################################
+    # Name : remove
+    # Function : marks nodes as not alive
+    ################################################################################
+    def remove(self, node_ids):
+        self._alive[node_ids] = False
+
+    ################################################################################
+    # Name : get_path
+    # Function : returns the node numbers from the root to the given node
+    ################################################################################
+    def get_path(self, node_id):
+        path = [node_id]
+        while self._parent[node_id] != node_id:
+            node_id = int(self._parent[node_id])
+            path.append(node_id)
+        path.reverse()
+        return np.array(path, dtype=np.int64)
+
+    ################################################################################
+    # Name : get_path_points
+    # Function : returns the (x, y) co-ordinates from the root to the given node
+    #            as an array of shape (path length, 2)
+    ################################################################################
+    def get_path_points(self, node_id):
+        path = self.get_path(node_id)
+        return np.stack((self._x[path], self._y[path]), axis=1)
+
+    ################################################################################
+    # Name : to_records
+    # Function : returns the tree as a structured array with fields x, y,
+    #            parent and alive
+    ################################################################################
+    def to_records(self):
+        records = np.empty(self.count, dtype=[('x', self._x.dtype), ('y', self._y.dtype),
+                                              ('parent', self._parent.dtype), ('alive', bool)])
+        records['x'] = self.x
+        records['y'] = self.y
+        records['parent'] = self.parent
+        records['alive'] = self.alive
+        return records
+
+    ################################################################################
+    # Name : save
+    # Function : writes the tree to a .npz file (arrays x, y, parent, alive) or to a
+    #            .npy file (structured array)
+    ################################################################################
+    def save(self, filename):
+        if str(filename).endswith('.npy'):
+            np.save(filename, self.to_records())
+        else:
+            np.savez(filename, x=self.x, y=self.y, parent=self.parent, alive=self.alive)
+
+    ################################################################################
+    # Name : load
+    # Function : reads a tree written by save. Trees saved without the alive
+    #            field are loaded with every node alive
+    ################################################################################
+    @classmethod
+    def load(cls, filename):
+        if str(filename).endswith('.npy'):
+            data = np.load(filename)
+            fields = data.dtype.names
+        else:
+            data = dict(np.load(filename))
+            fields = data.keys()
+
+        x, y, parent = data['x'], data['y'], data['parent']
+        alive = data['alive'] if 'alive' in fields else np.ones(len(x), dtype=bool)
+
+        tree = cls(max(len(x), 1), dtype=x.dtype)
+        tree._x[:len(x)] = x
+        tree._y[:len(y)] = y
+        tree._parent[:len(parent)] = parent
+        tree._alive[:len(alive)] = alive
+        tree.count = len(x)
+        return tree